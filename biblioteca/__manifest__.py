@@ -17,6 +17,9 @@ Sistema de Gestión de Biblioteca con multas automáticas
         'data/cron.xml',
         'views/views.xml',
         'views/configuracion_views.xml',
+        'views/templates.xml',
+        'views/perfilado_views.xml',
+        'views/archivo_views.xml',
     ],
     'assets': {
         'web.assets_backend': [
@@ -1,21 +1,131 @@
 # -*- coding: utf-8 -*-
-# from odoo import http
-
-
-# class Biblioteca(http.Controller):
-#     @http.route('/biblioteca/biblioteca', auth='public')
-#     def index(self, **kw):
-#         return "Hello, world"
-
-#     @http.route('/biblioteca/biblioteca/objects', auth='public')
-#     def list(self, **kw):
-#         return http.request.render('biblioteca.listing', {
-#             'root': '/biblioteca/biblioteca',
-#             'objects': http.request.env['biblioteca.biblioteca'].search([]),
-#         })
-
-#     @http.route('/biblioteca/biblioteca/objects/<model("biblioteca.biblioteca"):obj>', auth='public')
-#     def object(self, obj, **kw):
-#         return http.request.render('biblioteca.object', {
-#             'object': obj
-#         })
\ No newline at end of file
+import hashlib
+import hmac
+from datetime import datetime
+
+from werkzeug.http import http_date
+
+from odoo import http
+from odoo.http import request
+
+from ..models.metricas import exponer_metricas
+from ..models.opac import TTL_PAGINAS_OPAC, cache_opac
+
+
+class BibliotecaCirculacion(http.Controller):
+
+    @http.route('/biblioteca/circulacion', type='json', auth='user', methods=['POST'])
+    def circulacion(self, cedula, isbns, operacion='prestar', **kw):
+        """
+        Préstamo o devolución desde el mostrador sin pasar por el cliente web.
+        Recibe la cédula del lector y uno o varios ISBN escaneados.
+        """
+        if isinstance(isbns, str):
+            isbns = [isbns]
+        return request.env['biblioteca.prestamo'].circulacion(cedula, isbns, operacion)
+
+
+class BibliotecaCatalogo(http.Controller):
+    """
+    Catálogo público (OPAC) de solo lectura. Las páginas se sirven desde el cache
+    del proceso mientras sus libros no cambien, y con ETag/Last-Modified para que
+    navegadores y proxies puedan revalidar sin descargar la página otra vez.
+    """
+
+    _root = '/biblioteca/catalogo'
+    _por_pagina = 50
+    _campos_ficha = ['autor', 'editorial', 'genero', 'fecha_publicacion', 'paginas', 'isbn', 'ubicacion', 'description']
+
+    @http.route(['/biblioteca/catalogo', '/biblioteca/catalogo/objects'], type='http', auth='public', methods=['GET'])
+    def listing(self, despues=None, **kw):
+        despues = int(despues) if despues and despues.isdigit() else None
+        Libro = request.env['biblioteca.libro'].sudo()
+        return self._responder(('lista', despues), lambda: Libro.pagina_opac(despues, self._por_pagina),
+                               self._render_lista)
+
+    @http.route('/biblioteca/catalogo/objects/<int:libro_id>', type='http', auth='public', methods=['GET'])
+    def object(self, libro_id, **kw):
+        libro = request.env['biblioteca.libro'].sudo().browse(libro_id)
+        return self._responder(('libro', libro_id), lambda: (libro.exists(), None), self._render_libro)
+
+    def _responder(self, clave, seleccionar, renderizar):
+        """
+        ``seleccionar()`` devuelve (libros, extra) de la página; ``renderizar(libros, extra)``
+        su HTML. Solo se renderiza si el cliente no tiene ya la versión vigente.
+        """
+        base = request.env.cr.dbname
+        pagina = cache_opac.obtener(base, clave)
+        if pagina is None:
+            version = cache_opac.version()
+            libros, extra = seleccionar()
+            if clave[0] == 'libro' and not libros:
+                raise request.not_found()
+            etag, modificado = self._version(libros, extra)
+            if self._sin_cambios(etag, modificado):
+                return request.make_response('', headers=self._cabeceras(etag, modificado), status=304)
+            pagina = (renderizar(libros, extra), etag, modificado)
+            cache_opac.guardar(base, clave, version, libros.ids, pagina)
+        html, etag, modificado = pagina
+
+        cabeceras = self._cabeceras(etag, modificado)
+        if self._sin_cambios(etag, modificado):
+            return request.make_response('', headers=cabeceras, status=304)
+        return request.make_response(html, headers=cabeceras + [('Content-Type', 'text/html; charset=utf-8')])
+
+    def _cabeceras(self, etag, modificado):
+        return [
+            ('ETag', f'"{etag}"'),
+            ('Last-Modified', http_date(modificado)),
+            ('Cache-Control', f'public, max-age={TTL_PAGINAS_OPAC}'),
+        ]
+
+    def _sin_cambios(self, etag, modificado):
+        peticion = request.httprequest
+        if peticion.if_none_match:
+            return peticion.if_none_match.contains(etag)
+        return bool(peticion.if_modified_since) and modificado.replace(microsecond=0) <= \
+            peticion.if_modified_since.replace(tzinfo=None)
+
+    def _render_lista(self, libros, siguiente):
+        libros.fetch(['titulo', 'autor', 'ejemplares_disponibles', 'bloqueado'])
+        return str(request.env['ir.ui.view'].sudo()._render_template('biblioteca.listing', {
+            'root': self._root,
+            'objects': libros,
+            'siguiente': siguiente,
+        }))
+
+    def _render_libro(self, libro, _extra):
+        return str(request.env['ir.ui.view'].sudo()._render_template('biblioteca.object', {
+            'root': self._root,
+            'object': libro,
+            'campos': self._campos_ficha,
+        }))
+
+    def _version(self, libros, extra=None):
+        # ETag a partir de la fecha de escritura de cada libro y de sus préstamos
+        fechas = libros._ultima_modificacion_opac()
+        firma = ','.join(f"{libro_id}:{fecha.isoformat()}" for libro_id, fecha in fechas.items())
+        etag = hashlib.sha1(f"{firma}|{extra}".encode()).hexdigest()
+        modificado = max(fechas.values(), default=datetime(2000, 1, 1))
+        return etag, modificado
+
+
+class BibliotecaMetricas(http.Controller):
+
+    @http.route('/biblioteca/metricas', type='http', auth='public', methods=['GET'], csrf=False)
+    def metricas(self, token=None, **kw):
+        """
+        Métricas del worker que atiende la petición, en formato de texto de Prometheus.
+        Si el parámetro del sistema ``biblioteca.metricas_token`` tiene valor, hay que
+        enviarlo como ``Authorization: Bearer <token>`` o en ``?token=``.
+        """
+        esperado = request.env['ir.config_parameter'].sudo().get_param('biblioteca.metricas_token')
+        if esperado:
+            autorizacion = request.httprequest.headers.get('Authorization', '')
+            recibido = autorizacion.removeprefix('Bearer ').strip() or token
+            if not recibido or not hmac.compare_digest(recibido, esperado):
+                return request.make_response('Token inválido\n', status=403)
+        return request.make_response(exponer_metricas(), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ])
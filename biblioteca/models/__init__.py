@@ -1,3 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from . import models
\ No newline at end of file
+from . import models
+from . import perfilado
+from . import openlibrary
+from . import openlibrary_dump
+from . import ir_sequence
+from . import importador
+from . import archivo
+from . import cron_estado
\ No newline at end of file
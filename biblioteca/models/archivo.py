@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from odoo import models, fields, api, tools
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+from .perfilado import perfilado
+from . import metricas
+
+_logger = logging.getLogger(__name__)
+
+# Columnas que pasan tal cual de biblioteca_prestamo al archivo
+COLUMNAS_ARCHIVO = ('id', 'name', 'fecha_prestamo', 'fecha_maxima', 'fecha_devolucion', 'libro_id', 'usuario_id',
+                    'usuario', 'multa_bol', 'multa')
+
+
+class BibliotecaPrestamoArchivo(models.Model):
+    _name = 'biblioteca.prestamo.archivo'
+    _description = 'Préstamo Archivado'
+    _rec_name = 'name'
+    _order = 'fecha_prestamo desc, id desc'
+    _log_access = False
+
+    # Conserva el id que tenía en biblioteca_prestamo: las multas y el historial lo siguen encontrando
+    name = fields.Char(string='Prestamo', readonly=True)
+    fecha_prestamo = fields.Datetime(string='Fecha de Préstamo', readonly=True)
+    fecha_maxima = fields.Datetime(string='Fecha Máxima de Devolución', readonly=True)
+    fecha_devolucion = fields.Datetime(string='Fecha de Devolución', readonly=True)
+    libro_id = fields.Many2one('biblioteca.libro', string='Libro', required=True, readonly=True)
+    usuario_id = fields.Many2one('biblioteca.usuario', string='Usuario', required=True, readonly=True)
+    usuario = fields.Many2one('res.users', string='Usuario presta', readonly=True)
+    multa_bol = fields.Boolean(string='Tiene Multa', readonly=True)
+    multa = fields.Float(string='Monto Multa', readonly=True)
+    dias_retraso = fields.Integer(string='Días de Retraso', readonly=True)
+    fecha_archivo = fields.Datetime(string='Fecha de Archivo', readonly=True)
+    multa_ids = fields.One2many('biblioteca.multa', 'prestamo_archivo_id', string='Multas')
+
+    def init(self):
+        # El historial de un libro o de un lector se pagina por fecha de préstamo
+        create_index(self.env.cr, 'biblioteca_prestamo_archivo_libro_fecha_idx', self._table,
+                     ['libro_id', 'fecha_prestamo'])
+        create_index(self.env.cr, 'biblioteca_prestamo_archivo_usuario_fecha_idx', self._table,
+                     ['usuario_id', 'fecha_prestamo'])
+
+    @api.model
+    @perfilado
+    def archivar_prestamos(self, dias=None, batch_size=5000):
+        """
+        Mueve al archivo los préstamos devueltos hace más de ``dias`` días (por
+        defecto, los de la configuración) y sin multas pendientes, por lotes y
+        con un commit por lote. Las multas de esos préstamos pasan a apuntar al
+        préstamo archivado. Devuelve cuántos préstamos se archivaron.
+        """
+        if dias is None:
+            dias = self.env['biblioteca.configuracion'].get_parametros().dias_archivo_prestamos
+        if not dias or dias <= 0:
+            return 0
+        inicio = time.perf_counter()
+        limite = fields.Datetime.subtract(fields.Datetime.now(), days=dias)
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        columnas = SQL(", ").join(SQL.identifier(columna) for columna in COLUMNAS_ARCHIVO)
+
+        self.env.flush_all()
+        archivados = ultimo_id = 0
+        while True:
+            # SKIP LOCKED: un préstamo que alguien está tocando se queda para la siguiente ejecución
+            self.env.cr.execute(SQL("""
+                SELECT p.id FROM biblioteca_prestamo p
+                 WHERE p.estado = 'd'
+                   AND COALESCE(p.fecha_devolucion, p.write_date) < %(limite)s
+                   AND p.id > %(ultimo)s
+                   AND NOT EXISTS (SELECT 1 FROM biblioteca_multa m
+                                    WHERE m.prestamo_id = p.id AND m.state = 'pendiente')
+                 ORDER BY p.id
+                 LIMIT %(lote)s
+                   FOR UPDATE SKIP LOCKED
+            """, limite=limite, ultimo=ultimo_id, lote=batch_size))
+            ids = tuple(fila[0] for fila in self.env.cr.fetchall())
+            if not ids:
+                break
+            ahora = fields.Datetime.now()
+            self.env.cr.execute(SQL("""
+                INSERT INTO biblioteca_prestamo_archivo (%(columnas)s, dias_retraso, fecha_archivo)
+                SELECT %(columnas)s,
+                       GREATEST(COALESCE(date_part('day', fecha_devolucion - fecha_maxima), 0), 0)::int,
+                       %(ahora)s
+                  FROM biblioteca_prestamo
+                 WHERE id IN %(ids)s
+            """, columnas=columnas, ahora=ahora, ids=ids))
+            # Primero las multas: la FK hacia biblioteca_prestamo es ON DELETE RESTRICT
+            self.env.cr.execute(SQL("""
+                UPDATE biblioteca_multa
+                   SET prestamo_archivo_id = prestamo_id, prestamo_id = NULL, write_date = %s
+                 WHERE prestamo_id IN %s
+            """, ahora, ids))
+            self.env.cr.execute(SQL("DELETE FROM biblioteca_prestamo WHERE id IN %s", ids))
+            archivados += len(ids)
+            ultimo_id = ids[-1]
+            metricas.al_confirmar(self.env.cr, metricas.CRON_PRESTAMOS.inc, len(ids), cron='archivo')
+            if auto_commit:
+                self.env.cr.commit()
+            _logger.info(f"Archivo de préstamos: {archivados} préstamos archivados")
+
+        if archivados:
+            self.env['biblioteca.prestamo'].invalidate_model()
+            self.env['biblioteca.multa'].invalidate_model(['prestamo_id', 'prestamo_archivo_id'])
+            self.env['biblioteca.libro'].invalidate_model(['prestamo_ids'])
+            self.env['biblioteca.usuario'].invalidate_model(['prestamo_ids'])
+        _logger.info(f"Archivo completado: {archivados} préstamos devueltos antes de {limite} archivados")
+        self.env['biblioteca.prestamo']._registrar_ejecucion_cron('archivo', inicio)
+        return archivados
+
+
+class BibliotecaPrestamoHistorial(models.Model):
+    _name = 'biblioteca.prestamo.historial'
+    _description = 'Historial de Préstamos'
+    _rec_name = 'name'
+    _order = 'fecha_prestamo desc, id desc'
+    _auto = False
+
+    # Vista de solo lectura: préstamos vigentes y archivados juntos; los ids no se repiten
+    # porque el archivo conserva el id original
+    name = fields.Char(string='Prestamo', readonly=True)
+    libro_id = fields.Many2one('biblioteca.libro', string='Libro', readonly=True)
+    usuario_id = fields.Many2one('biblioteca.usuario', string='Usuario', readonly=True)
+    fecha_prestamo = fields.Datetime(string='Fecha de Préstamo', readonly=True)
+    fecha_maxima = fields.Datetime(string='Fecha Máxima de Devolución', readonly=True)
+    fecha_devolucion = fields.Datetime(string='Fecha de Devolución', readonly=True)
+    estado = fields.Selection(selection='_selection_estado', string='Estado', readonly=True)
+    multa = fields.Float(string='Monto Multa', readonly=True)
+    archivado = fields.Boolean(string='Archivado', readonly=True)
+
+    def _selection_estado(self):
+        # Los mismos estados que el préstamo, para no mantener dos listas
+        return self.env['biblioteca.prestamo']._fields['estado'].selection
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(SQL("""
+            CREATE OR REPLACE VIEW %s AS (
+                SELECT p.id, p.name, p.libro_id, p.usuario_id, p.fecha_prestamo, p.fecha_maxima,
+                       p.fecha_devolucion, p.estado, p.multa, FALSE AS archivado
+                  FROM biblioteca_prestamo p
+                 UNION ALL
+                SELECT a.id, a.name, a.libro_id, a.usuario_id, a.fecha_prestamo, a.fecha_maxima,
+                       a.fecha_devolucion, 'd', a.multa, TRUE
+                  FROM biblioteca_prestamo_archivo a
+            )
+        """, SQL.identifier(self._table)))
+
+    @api.model
+    def accion_historial(self, dominio, nombre):
+        """Acción de ventana del historial filtrado: la lista se carga al abrirla y por páginas."""
+        return {
+            'type': 'ir.actions.act_window',
+            'name': nombre,
+            'res_model': self._name,
+            'view_mode': 'list',
+            'domain': dominio,
+            'limit': 80,
+        }
+
+    def action_abrir_prestamo(self):
+        """Abre el préstamo de origen, en el archivo si ya fue archivado."""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'biblioteca.prestamo.archivo' if self.archivado else 'biblioteca.prestamo',
+            'res_id': self.id,
+            'view_mode': 'form',
+        }
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+
+class BibliotecaCronEstado(models.Model):
+    _name = 'biblioteca.cron.estado'
+    _description = 'Estado de los crons de la biblioteca'
+    _rec_name = 'clave'
+    _log_access = False
+
+    # Avance de los crons por lotes. No va en ir.config_parameter: cada set_param
+    # limpia la cache del registro en todos los workers
+    clave = fields.Char(string='Clave', required=True)
+    valor = fields.Char(string='Valor')
+    # Marca de agua: se baja con LEAST y ``cambios`` cuenta cada bajada para que
+    # el cron no pise una que llegó mientras corría
+    marca = fields.Datetime(string='Marca')
+    cambios = fields.Integer(string='Cambios')
+
+    _sql_constraints = [
+        ('clave_unique', 'unique(clave)', 'Ya existe un estado guardado con esta clave.'),
+    ]
+
+    @api.model
+    def leer(self, clave):
+        self.env.cr.execute(SQL("SELECT valor FROM biblioteca_cron_estado WHERE clave = %s", clave))
+        fila = self.env.cr.fetchone()
+        return fila[0] if fila and fila[0] else False
+
+    @api.model
+    def guardar(self, clave, valor):
+        # Upsert por SQL: el cron lo llama en cada lote y no debe tocar caches
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_cron_estado (clave, valor) VALUES (%s, %s)
+            ON CONFLICT (clave) DO UPDATE SET valor = EXCLUDED.valor
+        """, clave, valor or None))
+        self.invalidate_model()
+
+    @api.model
+    def leer_marca(self, clave):
+        """
+        Devuelve ``(marca, cambios)``, con la fila bloqueada hasta el siguiente
+        commit; la marca es None si no hay ninguna.
+        """
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_cron_estado (clave, cambios) VALUES (%s, 0)
+            ON CONFLICT (clave) DO NOTHING
+        """, clave))
+        self.env.cr.execute(SQL("SELECT marca, cambios FROM biblioteca_cron_estado WHERE clave = %s FOR UPDATE", clave))
+        return self.env.cr.fetchone()
+
+    @api.model
+    def bajar_marca(self, clave, fecha=None):
+        """
+        Baja la marca a ``fecha`` si estaba por encima, o la quita si no se da
+        ``fecha``, en un solo UPDATE: dos bajadas a la vez no se pisan.
+        """
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_cron_estado
+               SET marca = CASE WHEN marca IS NOT NULL AND %(fecha)s::timestamp IS NOT NULL
+                                THEN LEAST(marca, %(fecha)s::timestamp) END,
+                   cambios = cambios + 1
+             WHERE clave = %(clave)s
+        """, fecha=fecha, clave=clave))
+        self.invalidate_model(['marca', 'cambios'])
+
+    @api.model
+    def subir_marca(self, clave, marca, cambios):
+        """
+        Deja la marca en ``marca`` solo si nadie la bajó desde que se leyó con
+        ``cambios``. La fila queda bloqueada hasta el final de la transacción.
+        Devuelve si se cambió.
+        """
+        self.env.cr.execute(SQL("SELECT cambios FROM biblioteca_cron_estado WHERE clave = %s FOR UPDATE", clave))
+        fila = self.env.cr.fetchone()
+        if not fila or fila[0] != cambios:
+            return False
+        self.env.cr.execute(SQL("UPDATE biblioteca_cron_estado SET marca = %s WHERE clave = %s", marca, clave))
+        self.invalidate_model(['marca'])
+        return True
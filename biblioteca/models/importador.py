@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .openlibrary_dump import leer_lineas
+from .sql import valores_sql
+
+_logger = logging.getLogger(__name__)
+
+# Errores que se guardan con detalle en el resultado; el resto solo se cuenta
+MAX_ERRORES_DETALLE = 1000
+
+
+def leer_filas(ruta):
+    """
+    Devuelve ``(linea, fila)`` de un CSV con cabecera o de un JSON Lines (un
+    objeto por línea), comprimidos o no, leyendo el archivo de a poco.
+    Una línea JSON inválida se devuelve con ``fila`` None.
+    """
+    lineas = leer_lineas(ruta)
+    if ruta.removesuffix('.gz').endswith('.csv'):
+        # La cabecera es la línea 1
+        for numero, fila in enumerate(csv.DictReader(lineas), 2):
+            yield numero, {k: (v or '').strip() for k, v in fila.items() if k}
+        return
+    for numero, linea in enumerate(lineas, 1):
+        if linea.strip():
+            try:
+                yield numero, json.loads(linea)
+            except ValueError:
+                yield numero, None
+
+
+class BibliotecaImportador(models.AbstractModel):
+    _name = 'biblioteca.importador'
+    _description = 'Importador masivo de préstamos y multas'
+
+    @api.model
+    def importar_prestamos(self, ruta, lote=2000):
+        """
+        Importa el historial de préstamos de un CSV o JSON Lines con las columnas
+        isbn, cedula, fecha_prestamo y, opcionales, name, fecha_maxima,
+        fecha_devolucion, estado y multa. Ver ``_importar`` para el resultado.
+        """
+        return self._importar(ruta, lote, self._procesar_prestamos)
+
+    @api.model
+    def importar_multas(self, ruta, lote=2000):
+        """
+        Importa multas de un CSV o JSON Lines con las columnas prestamo (referencia
+        del préstamo ya importado), monto y, opcionales, name, tipo_multa,
+        dias_retraso, fecha_vencimiento y state.
+        """
+        return self._importar(ruta, lote, self._procesar_multas)
+
+    def _importar(self, ruta, lote, procesar):
+        """
+        Lee el archivo por lotes; cada lote se valida con consultas agrupadas, se
+        inserta de una vez y se confirma. Las filas con error no detienen la carga.
+        Devuelve {'importadas', 'errores', 'detalle_errores': [{'linea', 'error'}], 'filas_segundo'}.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        resultado = {'importadas': 0, 'errores': 0, 'detalle_errores': []}
+        inicio = time.perf_counter()
+
+        def registrar_error(linea, error):
+            resultado['errores'] += 1
+            if len(resultado['detalle_errores']) < MAX_ERRORES_DETALLE:
+                resultado['detalle_errores'].append({'linea': linea, 'error': error})
+
+        def vaciar(filas):
+            resultado['importadas'] += procesar(filas, registrar_error)
+            if auto_commit:
+                self.env.cr.commit()
+            transcurrido = time.perf_counter() - inicio
+            _logger.info(f"Importación {ruta}: {resultado['importadas']} filas importadas, "
+                         f"{resultado['errores']} con error ({resultado['importadas'] / transcurrido:.0f} filas/s)")
+
+        pendientes = []
+        for linea, fila in leer_filas(ruta):
+            if not isinstance(fila, dict):
+                registrar_error(linea, "La línea no es un objeto JSON válido.")
+                continue
+            pendientes.append((linea, fila))
+            if len(pendientes) >= lote:
+                vaciar(pendientes)
+                pendientes = []
+        if pendientes:
+            vaciar(pendientes)
+
+        transcurrido = time.perf_counter() - inicio
+        resultado['filas_segundo'] = round(resultado['importadas'] / max(transcurrido, 1e-6))
+        _logger.info(f"Importación {ruta} terminada en {transcurrido:.1f}s: {resultado['importadas']} filas, "
+                     f"{resultado['errores']} errores ({resultado['filas_segundo']} filas/s)")
+        return resultado
+
+    def _fecha(self, valor, convertir=fields.Datetime.to_datetime):
+        if not valor:
+            return None
+        try:
+            return convertir(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"Fecha inválida: {valor}")
+
+    def _numero(self, valor, tipo=float):
+        try:
+            return tipo(valor or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"Número inválido: {valor}")
+
+    def _nombres_existentes(self, modelo, nombres):
+        nombres = [nombre for nombre in nombres if nombre]
+        if not nombres:
+            return set()
+        return set(self.env[modelo].search_fetch([('name', 'in', nombres)], ['name']).mapped('name'))
+
+    def _procesar_prestamos(self, filas, registrar_error):
+        Libro = self.env['biblioteca.libro']
+        libros = Libro._buscar_por_isbns({str(fila.get('isbn') or '') for _linea, fila in filas})
+        usuarios = {
+            usuario.cedula: usuario for usuario in self.env['biblioteca.usuario'].search_fetch(
+                [('cedula', 'in', list({str(fila.get('cedula') or '') for _linea, fila in filas}))],
+                ['cedula', 'email', 'bloqueado_prestamo'])
+        }
+        existentes = self._nombres_existentes('biblioteca.prestamo', [fila.get('name') for _linea, fila in filas])
+        # Los préstamos abiertos descuentan stock: se bloquean los libros como en el mostrador
+        abiertos = Libro.union(*(libros[str(fila.get('isbn') or '')] for _linea, fila in filas
+                                 if (fila.get('estado') or 'p') in ('b', 'p', 'm')))
+        abiertos._bloquear_para_prestamo()
+        abiertos.fetch(['ejemplares_disponibles', 'bloqueado'])
+        dias_prestamo = self.env['biblioteca.configuracion'].get_parametros().dias_prestamo
+
+        validas = []
+        ocupados = Counter()
+        vistos = set()
+        for linea, fila in filas:
+            try:
+                libro = libros.get(str(fila.get('isbn') or ''))
+                usuario = usuarios.get(str(fila.get('cedula') or ''))
+                if not libro:
+                    raise ValueError(f"No existe un libro con el ISBN {fila.get('isbn')}.")
+                if not usuario:
+                    raise ValueError(f"No existe un lector con la cédula {fila.get('cedula')}.")
+                nombre = fila.get('name') or None
+                if nombre and (nombre in existentes or nombre in vistos):
+                    raise ValueError(f"El préstamo {nombre} ya fue importado.")
+                fecha_prestamo = self._fecha(fila.get('fecha_prestamo'))
+                if not fecha_prestamo:
+                    raise ValueError("Falta la fecha de préstamo.")
+                fecha_devolucion = self._fecha(fila.get('fecha_devolucion'))
+                estado = fila.get('estado') or ('d' if fecha_devolucion else 'p')
+                if estado not in ('b', 'p', 'm', 'd'):
+                    raise ValueError(f"Estado desconocido: {estado}")
+                if estado in ('b', 'p'):
+                    if usuario.bloqueado_prestamo:
+                        raise ValueError(f"El usuario {usuario.cedula} tiene multas pendientes.")
+                    if libro.bloqueado:
+                        raise ValueError(f"El libro {fila.get('isbn')} está bloqueado por una multa.")
+                if estado in ('p', 'm'):
+                    if libro.ejemplares_disponibles - ocupados[libro.id] < 1:
+                        raise ValueError(f"No hay ejemplares disponibles del libro {fila.get('isbn')}.")
+                    ocupados[libro.id] += 1
+                multa = self._numero(fila.get('multa'))
+                fecha_maxima = self._fecha(fila.get('fecha_maxima')) or fecha_prestamo + timedelta(days=dias_prestamo)
+            except ValueError as e:
+                registrar_error(linea, str(e))
+                continue
+            if nombre:
+                vistos.add(nombre)
+            validas.append([nombre, fecha_prestamo, libro.id, usuario.id, usuario.email or None,
+                            fecha_devolucion, bool(multa), multa, fecha_maxima, estado])
+
+        if not validas:
+            return 0
+        sin_nombre = [fila for fila in validas if not fila[0]]
+        nombres = self.env['ir.sequence'].next_block_by_code('biblioteca.prestamo', len(sin_nombre))
+        for fila, nombre in zip(sin_nombre, nombres or ['/'] * len(sin_nombre)):
+            fila[0] = nombre
+
+        # Los prestados y los borradores (que se prestarán luego) quedan pendientes de aviso de vencimiento
+        self.env.flush_all()
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_prestamo (name, fecha_prestamo, libro_id, usuario_id, email_lector,
+                                             fecha_devolucion, multa_bol, multa, fecha_maxima, estado,
+                                             notificacion_enviada, fecha_proximo_devengo, usuario,
+                                             create_uid, write_uid, create_date, write_date)
+            SELECT v.name, v.fecha_prestamo::timestamp, v.libro_id::int, v.usuario_id::int, v.email,
+                   v.fecha_devolucion::timestamp, v.multa_bol::bool, v.multa::float8,
+                   v.fecha_maxima::timestamp, v.estado, v.estado IN ('m', 'd'),
+                   CASE WHEN v.estado = 'm' AND v.fecha_devolucion IS NULL THEN %(ahora)s END, %(uid)s,
+                   %(uid)s, %(uid)s, %(ahora)s, %(ahora)s
+              FROM (VALUES %(valores)s) AS v(name, fecha_prestamo, libro_id, usuario_id, email, fecha_devolucion,
+                                             multa_bol, multa, fecha_maxima, estado)
+        """, uid=self.env.uid, ahora=self.env.cr.now(), valores=valores_sql(validas)))
+
+        # Un préstamo importado sigue prestado con fecha antigua: el cron de vencidos debe verlo
+        fechas_prestados = [fila[8] for fila in validas if fila[9] == 'p']
+        if fechas_prestados:
+            self.env['biblioteca.prestamo']._bajar_marca_vencidos(min(fechas_prestados))
+        libros_afectados = Libro.browse({fila[2] for fila in validas})
+        usuarios_afectados = self.env['biblioteca.usuario'].browse({fila[3] for fila in validas})
+        self._recalcular(libros_afectados, ['ejemplares_disponibles'])
+        self._recalcular(usuarios_afectados, ['prestamo_count'])
+        libros_afectados._invalidar_opac()
+        return len(validas)
+
+    def _procesar_multas(self, filas, registrar_error):
+        Multa = self.env['biblioteca.multa']
+        prestamos = {
+            prestamo.name: prestamo for prestamo in self.env['biblioteca.prestamo'].search_fetch(
+                [('name', 'in', list({fila.get('prestamo') for _linea, fila in filas if fila.get('prestamo')}))],
+                ['name', 'usuario_id', 'libro_id'])
+        }
+        existentes = self._nombres_existentes('biblioteca.multa', [fila.get('name') for _linea, fila in filas])
+        tipos = dict(Multa._fields['tipo_multa'].selection)
+        estados = dict(Multa._fields['state'].selection)
+        vencimiento = fields.Date.today() + timedelta(days=30)
+
+        validas = []
+        vistos = set()
+        for linea, fila in filas:
+            try:
+                prestamo = prestamos.get(fila.get('prestamo'))
+                if not prestamo:
+                    raise ValueError(f"No existe el préstamo {fila.get('prestamo')}.")
+                nombre = fila.get('name') or None
+                if nombre and (nombre in existentes or nombre in vistos):
+                    raise ValueError(f"La multa {nombre} ya fue importada.")
+                tipo = fila.get('tipo_multa') or 'retraso'
+                estado = fila.get('state') or 'pendiente'
+                if tipo not in tipos:
+                    raise ValueError(f"Tipo de multa desconocido: {tipo}")
+                if estado not in estados:
+                    raise ValueError(f"Estado de multa desconocido: {estado}")
+                monto = self._numero(fila.get('monto'))
+                if monto < 0:
+                    raise ValueError(f"El monto no puede ser negativo: {monto}")
+                dias = self._numero(fila.get('dias_retraso'), int)
+                fecha_vencimiento = self._fecha(fila.get('fecha_vencimiento'), fields.Date.to_date) or vencimiento
+            except ValueError as e:
+                registrar_error(linea, str(e))
+                continue
+            if nombre:
+                vistos.add(nombre)
+            validas.append([nombre, prestamo.usuario_id.id, prestamo.id, tipo, monto, dias, fecha_vencimiento, estado])
+
+        if not validas:
+            return 0
+        sin_nombre = [fila for fila in validas if not fila[0]]
+        nombres = self.env['ir.sequence'].next_block_by_code('biblioteca.multa', len(sin_nombre))
+        for fila, nombre in zip(sin_nombre, nombres or ['/'] * len(sin_nombre)):
+            fila[0] = nombre
+
+        self.env.flush_all()
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_multa (name, usuario_id, prestamo_id, tipo_multa, monto, dias_retraso,
+                                          fecha_vencimiento, state, create_uid, write_uid, create_date, write_date)
+            SELECT v.name, v.usuario_id::int, v.prestamo_id::int, v.tipo_multa, v.monto::float8, v.dias::int,
+                   v.fecha_vencimiento::date, v.state, %(uid)s, %(uid)s, %(ahora)s, %(ahora)s
+              FROM (VALUES %(valores)s) AS v(name, usuario_id, prestamo_id, tipo_multa, monto, dias,
+                                             fecha_vencimiento, state)
+            RETURNING id, prestamo_id, tipo_multa, monto, state
+        """, uid=self.env.uid, ahora=self.env.cr.now(), valores=valores_sql(validas)))
+        insertadas = self.env.cr.fetchall()
+
+        # Igual que las multas generadas por el sistema: el préstamo refleja su multa por
+        # retraso y un libro dañado o perdido queda bloqueado mientras la multa esté pendiente
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_prestamo p
+               SET multa = m.monto, multa_bol = TRUE, write_date = %(ahora)s
+              FROM biblioteca_multa m
+             WHERE m.id IN %(ids)s AND m.prestamo_id = p.id AND m.tipo_multa = 'retraso'
+        """, ahora=self.env.cr.now(), ids=tuple(fila[0] for fila in insertadas)))
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_libro l
+               SET multa_bloqueo_id = m.id, write_date = %(ahora)s
+              FROM biblioteca_multa m, biblioteca_prestamo p
+             WHERE m.id IN %(ids)s AND m.prestamo_id = p.id AND l.id = p.libro_id
+               AND m.tipo_multa IN ('danado', 'perdido') AND m.state = 'pendiente'
+               AND l.multa_bloqueo_id IS NULL
+         RETURNING l.id
+        """, ahora=self.env.cr.now(), ids=tuple(fila[0] for fila in insertadas)))
+        libros_bloqueados = self.env['biblioteca.libro'].browse([fila[0] for fila in self.env.cr.fetchall()])
+
+        self._recalcular(libros_bloqueados, ['bloqueado'])
+        self._recalcular(self.env['biblioteca.usuario'].browse({fila[1] for fila in validas}),
+                         ['multa_pendiente_count', 'bloqueado_prestamo'])
+        libros_bloqueados._invalidar_opac()
+        return len(validas)
+
+    def _recalcular(self, registros, campos):
+        """Recalcula campos almacenados que dependen de filas insertadas por SQL."""
+        if not registros:
+            return
+        self.env.invalidate_all()
+        for campo in campos:
+            self.env.add_to_compute(registros._fields[campo], registros)
+        registros.flush_recordset(campos)
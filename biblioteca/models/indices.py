@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+# Índices de circulación que crean los init() de los préstamos y las multas:
+# (nombre, columnas, condición del índice parcial o '').
+# No importa nada de Odoo para que scripts/benchmark_indices.py mida exactamente estos.
+
+INDICES_PRESTAMO = (
+    # Cron de vencidos: préstamos prestados sin notificar, por fecha máxima
+    ('biblioteca_prestamo_vencidos_sin_notificar_idx', ['fecha_maxima'],
+     "estado = 'p' AND notificacion_enviada IS NOT TRUE"),
+    # Acumulación de multas: préstamos abiertos y sin devolver
+    ('biblioteca_prestamo_abiertos_idx', ['fecha_maxima'],
+     "estado IN ('p', 'm') AND fecha_devolucion IS NULL"),
+    # Disponibilidad por libro e historial de préstamos del libro
+    ('biblioteca_prestamo_libro_estado_idx', ['libro_id', 'estado'], ''),
+    # Cola de préstamos con multa que acumula: el cron solo lee los que ya cumplieron otro día
+    ('biblioteca_prestamo_proximo_devengo_idx', ['fecha_proximo_devengo'],
+     "fecha_proximo_devengo IS NOT NULL"),
+)
+
+INDICES_MULTA = (
+    # Multa pendiente de un préstamo por tipo (cron y devoluciones)
+    ('biblioteca_multa_prestamo_tipo_estado_idx', ['prestamo_id', 'tipo_multa', 'state'], ''),
+    # Contador de multas pendientes por lector
+    ('biblioteca_multa_pendientes_usuario_idx', ['usuario_id'], "state = 'pendiente'"),
+)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def next_block_by_code(self, sequence_code, cantidad, sequence_date=None):
+        """
+        Como ``next_by_code`` pero reserva ``cantidad`` números de una vez.
+        Devuelve la lista de referencias ya formateadas, o [] si la secuencia no existe.
+        """
+        if cantidad <= 0:
+            return []
+        self.check_access('read')
+        company_ids = self.env.companies.ids + [False]
+        secuencia = self.search([('code', '=', sequence_code), ('company_id', 'in', company_ids)],
+                                order='company_id', limit=1)
+        if not secuencia:
+            _logger.debug(f"No hay una secuencia con el código {sequence_code}")
+            return []
+        return secuencia._reservar_bloque(cantidad, sequence_date)
+
+    def _reservar_bloque(self, cantidad, sequence_date=None):
+        self.ensure_one()
+        if not self.use_date_range:
+            numeros = self._numeros_bloque(f'ir_sequence_{self.id:03d}', self, cantidad)
+            return [self.get_next_char(numero) for numero in numeros]
+        fecha = sequence_date or self.env.context.get('ir_sequence_date') or fields.Date.today()
+        rango = self.env['ir.sequence.date_range'].search([
+            ('sequence_id', '=', self.id), ('date_from', '<=', fecha), ('date_to', '>=', fecha),
+        ], limit=1) or self._create_date_range_seq(fecha)
+        numeros = self._numeros_bloque(f'ir_sequence_{self.id:03d}_{rango.id:03d}', rango, cantidad)
+        secuencia = self.with_context(ir_sequence_date=fecha, ir_sequence_date_range=rango.date_from)
+        return [secuencia.get_next_char(numero) for numero in numeros]
+
+    def _numeros_bloque(self, secuencia_pg, registro, cantidad):
+        """
+        Números reservados en ``registro`` (la secuencia o su rango de fechas).
+        Las secuencias estándar usan nextval de PostgreSQL, que nunca entrega el
+        mismo número a dos transacciones aunque deja huecos si una hace rollback.
+        Las "sin huecos" bloquean la fila y avanzan el contador de una vez.
+        """
+        if self.implementation == 'standard':
+            self.env.cr.execute(SQL("SELECT nextval(%s) FROM generate_series(1, %s)", secuencia_pg, cantidad))
+            return sorted(fila[0] for fila in self.env.cr.fetchall())
+        self.env.cr.execute(SQL("SELECT number_next FROM %s WHERE id = %s FOR UPDATE NOWAIT",
+                                SQL.identifier(registro._table), registro.id))
+        inicio = self.env.cr.fetchone()[0]
+        self.env.cr.execute(SQL("UPDATE %s SET number_next = number_next + %s WHERE id = %s",
+                                SQL.identifier(registro._table), self.number_increment * cantidad, registro.id))
+        registro.invalidate_recordset(['number_next'])
+        return [inicio + i * self.number_increment for i in range(cantidad)]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Cada worker lleva sus propias métricas en memoria; la etiqueta pid las distingue
+# al agregarlas en Prometheus (sum by ... sin pid). Se lee al exponer: los workers
+# pueden haber importado el módulo antes del fork.
+
+LATENCIAS_RAPIDAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENCIAS_CRON = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600)
+
+_metricas = []
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = [*zip(nombres, valores), *extra, ('pid', os.getpid())]
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + '}'
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(nombre, '')) for nombre in self.etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for clave, valor in valores:
+            lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+    def _lineas(self, clave, valor):
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {valor}"]
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+
+class Indicador(_Metrica):
+    tipo = 'gauge'
+
+    def set(self, valor, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LATENCIAS_RAPIDAS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            # [cuentas por cubeta..., +Inf, suma]
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [0] * (len(self.limites) + 1) + [0.0]
+            datos[bisect.bisect_left(self.limites, valor)] += 1
+            datos[-1] += valor
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def _lineas(self, clave, datos):
+        lineas, acumulado = [], 0
+        for limite, cuenta in zip((*self.limites, '+Inf'), datos[:-1]):
+            acumulado += cuenta
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, [('le', limite)])} {acumulado}")
+        lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {datos[-1]}")
+        lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+
+def exponer_metricas():
+    """Todas las métricas del proceso en el formato de texto de Prometheus."""
+    return '\n'.join(linea for metrica in _metricas for linea in metrica.exponer()) + '\n'
+
+
+CIRCULACION = Contador(
+    'biblioteca_circulacion_total', "Libros procesados en préstamos y devoluciones, por resultado.",
+    ('operacion', 'canal', 'resultado'))
+CIRCULACION_SEGUNDOS = Histograma(
+    'biblioteca_circulacion_segundos', "Duración de los préstamos y devoluciones.", ('operacion', 'canal'))
+DEVOLUCIONES = Contador(
+    'biblioteca_devoluciones_total', "Préstamos devueltos, a tiempo o con retraso.", ('resultado',))
+
+CRON_SEGUNDOS = Histograma(
+    'biblioteca_cron_segundos', "Duración de cada ejecución de los crons.", ('cron',), LATENCIAS_CRON)
+CRON_PRESTAMOS = Contador(
+    'biblioteca_cron_prestamos_procesados_total', "Préstamos procesados por los crons.", ('cron',))
+CRON_ULTIMA_EJECUCION = Indicador(
+    'biblioteca_cron_ultima_ejecucion_timestamp', "Hora (epoch) en que terminó la última ejecución del cron.",
+    ('cron',))
+MULTAS_CREADAS = Contador(
+    'biblioteca_multas_creadas_total', "Multas generadas por el sistema, por tipo.", ('tipo',))
+CORREOS_ENCOLADOS = Contador(
+    'biblioteca_correos_encolados_total', "Correos de multa puestos en la cola de envío.")
+
+OPENLIBRARY = Contador(
+    'biblioteca_openlibrary_peticiones_total', "Consultas a OpenLibrary: cache (hit), red (miss) o error.",
+    ('resultado',))
+OPENLIBRARY_SEGUNDOS = Histograma(
+    'biblioteca_openlibrary_segundos', "Duración de las peticiones HTTP a OpenLibrary.")
+
+
+def al_confirmar(cr, funcion, *args, **kwargs):
+    """Cuenta solo lo que llega a confirmarse: un rollback o un reintento por concurrencia no suma."""
+    cr.postcommit.add(functools.partial(funcion, *args, **kwargs))
@@ -1,39 +1,194 @@
 # -*- coding: utf-8 -*-
 
-import requests
-from odoo import models, fields, api
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+from typing import NamedTuple
+from odoo import models, fields, api, tools
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+from .openlibrary import LimitadorTasa, datos_libro, datos_libros_en_paralelo
+from .indices import INDICES_MULTA, INDICES_PRESTAMO
+from .opac import cache_opac
+from .perfilado import perfilado
+from . import metricas
 from datetime import datetime, timedelta
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Clave de biblioteca.cron.estado donde el cron de vencidos guarda su avance ("fecha|ultimo_id")
+CHECKPOINT_VENCIDOS = 'biblioteca.cron_vencidos_checkpoint'
+
+# Marca de agua del cron de vencidos, en biblioteca.cron.estado: fecha máxima hasta la que ya se revisaron
+# los préstamos
+MARCA_VENCIDOS = 'biblioteca.cron_vencidos_marca'
+
+# Recálculo pendiente de fechas máximas tras cambiar el plazo ("dias_prestamo|ultimo_id")
+CHECKPOINT_FECHAS_MAXIMAS = 'biblioteca.recalculo_fecha_maxima_checkpoint'
+
+# Campos del libro que alimentan el índice de texto completo
+CAMPOS_BUSQUEDA_LIBRO = {'titulo', 'autor', 'genero', 'description'}
+
+# Memo de resolución de nombres de la transacción en curso: {cursor: {modelo: {nombre_normalizado: id}}}
+_memo_nombres = weakref.WeakKeyDictionary()
+
+
+def normalizar_isbn(codigo):
+    """
+    Devuelve el ISBN-13 de un ISBN-10 o ISBN-13 con guiones o espacios, o False
+    si el código no es un ISBN válido (longitud o dígito de control).
+    """
+    digitos = ''.join(c for c in (codigo or '').upper() if c.isdigit() or c == 'X')
+    if len(digitos) == 10 and digitos[:9].isdigit():
+        total = sum((10 - i) * (10 if c == 'X' else int(c)) for i, c in enumerate(digitos))
+        if total % 11:
+            return False
+        digitos = '978' + digitos[:9]
+        control = (10 - sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digitos)) % 10) % 10
+        return digitos + str(control)
+    if len(digitos) == 13 and digitos.isdigit():
+        if sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digitos)) % 10:
+            return False
+        return digitos
+    return False
+
+
+def normalizar_nombre(nombre):
+    """Forma canónica de un nombre: sin espacios repetidos ni mayúsculas."""
+    return ' '.join((nombre or '').split()).lower() or False
+
+
+class BibliotecaNombreNormalizadoMixin(models.AbstractModel):
+    _name = 'biblioteca.nombre.normalizado.mixin'
+    _description = 'Búsqueda o creación por nombre normalizado'
+    _campo_nombre = 'name'
+
+    nombre_normalizado = fields.Char(compute='_compute_nombre_normalizado', store=True, index=True)
+
+    @api.depends(lambda self: [self._campo_nombre])
+    def _compute_nombre_normalizado(self):
+        for record in self:
+            record.nombre_normalizado = normalizar_nombre(record[record._campo_nombre])
+
+    def _valores_nombre(self, nombre):
+        return {self._campo_nombre: nombre}
+
+    @api.model
+    def resolver_nombres(self, nombres):
+        """
+        Devuelve {nombre: id} para una lista de nombres, creando los que faltan.
+        Usa una consulta para los existentes y un solo create para los nuevos;
+        lo ya resuelto en la transacción se sirve desde un memo sin consultar.
+        """
+        cr = self.env.cr
+        memos = _memo_nombres.setdefault(cr, defaultdict(dict))
+        # El memo vale para una sola transacción: commit y rollback vacían los callbacks
+        # del cursor, así que se registran de nuevo en cada transacción que lo usa
+        if 'biblioteca.memo_nombres' not in cr.postrollback.data:
+            cr.postrollback.data['biblioteca.memo_nombres'] = True
+            cr.postrollback.add(memos.clear)
+            cr.postcommit.add(memos.clear)
+        memo = memos[self._name]
+
+        normalizados = {nombre: normalizar_nombre(nombre) for nombre in nombres}
+        faltan = {clave for clave in normalizados.values() if clave and clave not in memo}
+        if faltan:
+            for record in self.search_fetch([('nombre_normalizado', 'in', list(faltan))], ['nombre_normalizado'],
+                                            order='id'):
+                memo.setdefault(record.nombre_normalizado, record.id)
+            nuevos = {}
+            for nombre, clave in normalizados.items():
+                if clave and clave not in memo:
+                    nuevos.setdefault(clave, ' '.join(nombre.split()))
+            for record in self.create([self._valores_nombre(nombre) for nombre in nuevos.values()]):
+                memo[record.nombre_normalizado] = record.id
+        return {nombre: memo[clave] for nombre, clave in normalizados.items() if clave}
+
+
+class ParametrosBiblioteca(NamedTuple):
+    """Configuración vigente de la biblioteca, sin dependencias del ORM."""
+    id: int
+    dias_prestamo: int
+    dias_gracia_notificacion: int
+    monto_multa_dia: float
+    email_biblioteca: str
+    dias_archivo_prestamos: int
+
 
 class BibliotecaAutor(models.Model):
     _name = 'biblioteca.autor'
+    _inherit = ['biblioteca.nombre.normalizado.mixin']
     _description = 'Autor de la Biblioteca'
     _rec_name = 'display_name'
+    _campo_nombre = 'display_name'
 
     firstname = fields.Char(string='Nombre')
     lastname = fields.Char(string='Apellido')
     nacimiento = fields.Date()
-    display_name = fields.Char(compute='_compute_display_name', store=True)
+    display_name = fields.Char(compute='_compute_display_name', store=True, index='trigram')
     libro_ids = fields.One2many('biblioteca.libro', 'autor', string='Libros Escritos')
+    openlibrary_key = fields.Char(string='Clave OpenLibrary', readonly=True, copy=False)
+
+    _sql_constraints = [
+        ('openlibrary_key_unique', 'unique(openlibrary_key)', 'Ya existe un autor con esa clave de OpenLibrary.'),
+    ]
 
     @api.depends('firstname', 'lastname')
     def _compute_display_name(self):
         for record in self:
             record.display_name = f"{record.firstname or ''} {record.lastname or ''}".strip()
 
+    def _valores_nombre(self, nombre):
+        return {'firstname': nombre}
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self.ids and {'firstname', 'lastname'} & set(vals):
+            # El nombre del autor forma parte del índice de búsqueda de sus libros
+            self.flush_recordset(['display_name'])
+            self.env['biblioteca.libro']._actualizar_busqueda_sql(SQL("l.autor IN %s", tuple(self.ids)))
+            self.libro_ids._invalidar_opac()
+        return res
+
+    @api.model
+    def _name_search(self, name, domain=None, operator='ilike', limit=None, order=None):
+        if not name or operator != 'ilike' or not self.env.registry.has_trigram:
+            return super()._name_search(name, domain, operator, limit, order)
+        # Coincidencia parcial o aproximada (pg_trgm), las más parecidas primero
+        query = self._search(domain or [], limit=limit)
+        query.add_where(SQL("(biblioteca_autor.display_name ILIKE %s OR biblioteca_autor.display_name %% %s)",
+                            f"%{name}%", name))
+        query.order = SQL("similarity(biblioteca_autor.display_name, %s) DESC, biblioteca_autor.id", name)
+        return query
+
+    def init(self):
+        # Los autores importados de OpenLibrary pueden repetir nombre; el resto no
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute(SQL("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS biblioteca_autor_nombre_normalizado_uniq
+                        ON biblioteca_autor (nombre_normalizado) WHERE openlibrary_key IS NULL
+                """))
+        except Exception as e:
+            _logger.warning(f"No se pudo crear el índice único de autores (¿nombres duplicados?): {e}")
+
 
 class BibliotecaEditorial(models.Model):
     _name = 'biblioteca.editorial'
+    _inherit = ['biblioteca.nombre.normalizado.mixin']
     _description = 'Editorial de libros'
 
     name = fields.Char(string='Nombre Editorial', required=True)
     pais = fields.Char(string='País')
     ciudad = fields.Char(string='Ciudad')
 
+    _sql_constraints = [
+        ('nombre_normalizado_unique', 'unique(nombre_normalizado)', 'Ya existe una editorial con ese nombre.'),
+    ]
+
 
 class BibliotecaLibro(models.Model):
     _name = 'biblioteca.libro'
@@ -41,7 +196,7 @@ class BibliotecaLibro(models.Model):
     _rec_name = 'titulo'
 
     firstname = fields.Char(string='Nombre de búsqueda')
-    titulo = fields.Char(string='Título del Libro')
+    titulo = fields.Char(string='Título del Libro', index='trigram')
     autor = fields.Many2one('biblioteca.autor', string='Autor')
     ejemplares = fields.Integer(string='Número de ejemplares', default=1)
     costo = fields.Float(string='Costo')
@@ -49,11 +204,23 @@ class BibliotecaLibro(models.Model):
     fecha_publicacion = fields.Date(string='Fecha de Publicación')
     genero = fields.Char(string='Género')
     isbn = fields.Char(string='ISBN')
+    isbn13 = fields.Char(string='ISBN-13', compute='_compute_isbn13', store=True, index=True,
+                         help="ISBN normalizado a 13 dígitos, usado para buscar por código de barras.")
     paginas = fields.Integer(string='Páginas')
     editorial = fields.Many2one('biblioteca.editorial', string='Editorial')
     ubicacion = fields.Char(string='Categoría')
+    openlibrary_key = fields.Char(string='Clave OpenLibrary', readonly=True, copy=False,
+                                  help="Obra de OpenLibrary de la que proviene el libro (catálogo importado).")
+
+    _sql_constraints = [
+        ('openlibrary_key_unique', 'unique(openlibrary_key)', 'Ya existe un libro con esa clave de OpenLibrary.'),
+        ('isbn13_unique', 'unique(isbn13)', 'Ya existe un libro con ese ISBN.'),
+    ]
 
     prestamo_ids = fields.One2many('biblioteca.prestamo', 'libro_id', string='Historial de Préstamos')
+    # Lo que muestra el formulario; el historial completo se abre aparte y paginado
+    prestamo_abierto_ids = fields.One2many('biblioteca.prestamo', 'libro_id', string='Préstamos Abiertos',
+                                           domain=[('estado', '!=', 'd')])
 
     multa_bloqueo_id = fields.Many2one('biblioteca.multa',    #define si el libro sirve o si esta bloqueado por algo
                                        string='Multa que Bloquea', 
@@ -62,74 +229,401 @@ class BibliotecaLibro(models.Model):
     
     bloqueado = fields.Boolean(compute='_compute_bloqueado', store=True, string='Bloqueado por Multa')
 
+    ejemplares_disponibles = fields.Integer(compute='_compute_ejemplares_disponibles', store=True,
+                                            string='Ejemplares Disponibles',
+                                            help="Ejemplares que no están prestados ni retenidos por una multa.")
+
     @api.depends('multa_bloqueo_id') #cada que cambie la multa esto se ejecute
     def _compute_bloqueado(self):
         for record in self:
             record.bloqueado = bool(record.multa_bloqueo_id) #si existe regresa true, sino falsoe
 
+    @api.depends('isbn')
+    def _compute_isbn13(self):
+        for record in self:
+            record.isbn13 = normalizar_isbn(record.isbn)
+
+    @api.constrains('isbn')
+    def _check_isbn(self):
+        for record in self:
+            if record.isbn and not record.isbn13:
+                raise ValidationError(f"El ISBN '{record.isbn}' no es válido: revise los dígitos y el dígito de control.")
+
+    @api.model
+    def buscar_por_isbn(self, codigo):
+        """Devuelve el libro de un ISBN-10 o ISBN-13 escaneado, con una consulta indexada."""
+        isbn13 = normalizar_isbn(codigo)
+        return self.search([('isbn13', '=', isbn13)], limit=1) if isbn13 else self.browse()
+
+    @api.model
+    def _buscar_por_isbns(self, codigos):
+        """Devuelve {codigo: libro} para varios ISBN con una sola consulta."""
+        normalizados = {codigo: normalizar_isbn(codigo) for codigo in codigos}
+        libros = self.search([('isbn13', 'in', [n for n in normalizados.values() if n])])
+        por_isbn13 = {libro.isbn13: libro for libro in libros}
+        return {codigo: por_isbn13.get(n, self.browse()) for codigo, n in normalizados.items()}
+
+    @api.model
+    def action_fusionar_duplicados_isbn(self):
+        """Acción del menú: fusiona los duplicados y notifica el resultado."""
+        resultado = self.fusionar_duplicados_isbn()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': "Libros duplicados por ISBN",
+                'message': f"{resultado['grupos']} ISBN duplicados, {resultado['eliminados']} libros fusionados.",
+                'type': 'success',
+            },
+        }
+
+    @api.model
+    def fusionar_duplicados_isbn(self):
+        """
+        Fusiona los libros que comparten ISBN-13 en el más antiguo: suma los
+        ejemplares, le pasa los préstamos y el bloqueo por multa, y elimina el resto.
+        """
+        self.env.flush_all()
+        # Solo los grupos duplicados salen de la base; el resto del catálogo no se carga
+        self.env.cr.execute(SQL("""
+            SELECT isbn13, array_agg(id ORDER BY id) FROM biblioteca_libro
+             WHERE isbn13 IS NOT NULL
+             GROUP BY isbn13 HAVING count(*) > 1
+        """))
+        duplicados = {isbn13: self.browse(ids) for isbn13, ids in self.env.cr.fetchall()}
+
+        eliminados = 0
+        for isbn13, libros in duplicados.items():
+            principal, resto = libros[0], libros[1:]
+            for tabla in ('biblioteca_prestamo', 'biblioteca_prestamo_archivo'):
+                self.env.cr.execute(SQL(
+                    "UPDATE %s SET libro_id = %s WHERE libro_id IN %s",
+                    SQL.identifier(tabla), principal.id, tuple(resto.ids),
+                ))
+            self.env['biblioteca.prestamo'].invalidate_model(['libro_id'])
+            self.env['biblioteca.prestamo.archivo'].invalidate_model(['libro_id'])
+            valores = {'ejemplares': sum(libros.mapped('ejemplares'))}
+            if not principal.multa_bloqueo_id and resto.multa_bloqueo_id:
+                valores['multa_bloqueo_id'] = resto.multa_bloqueo_id[0].id
+            for campo in ('titulo', 'autor', 'editorial', 'description', 'genero', 'paginas',
+                          'fecha_publicacion', 'costo', 'openlibrary_key'):
+                if not principal[campo] and any(resto.mapped(campo)):
+                    valores[campo] = next(valor for valor in resto.mapped(campo) if valor)
+            if valores.get('openlibrary_key'):
+                resto.write({'openlibrary_key': False})
+            resto.unlink()
+            principal.write(dict(valores, isbn=isbn13))
+            eliminados += len(resto)
+            _logger.info(f"ISBN {isbn13}: {len(resto)} libros fusionados en {principal.titulo} ({principal.id})")
+        return {'grupos': len(duplicados), 'eliminados': eliminados}
+
+    @api.depends('ejemplares', 'prestamo_ids.estado')
+    def _compute_ejemplares_disponibles(self):
+        # Solo se recalculan los libros afectados, con una consulta agrupada para todos
+        activos = self._origin._contar_prestamos_activos()
+        for record in self:
+            record.ejemplares_disponibles = record.ejemplares - activos.get(record._origin.id, 0)
+
+    def action_ver_historial(self):
+        self.ensure_one()
+        return self.env['biblioteca.prestamo.historial'].accion_historial(
+            [('libro_id', '=', self.id)], f"Historial de {self.titulo}")
+
+    def _contar_prestamos_activos(self):
+        """Devuelve {libro_id: préstamos en estado prestado/multa} con un solo read_group."""
+        if not self.ids:
+            return {}
+        grupos = self.env['biblioteca.prestamo']._read_group(
+            [('libro_id', 'in', self.ids), ('estado', 'in', ['p', 'm'])],
+            ['libro_id'], ['__count'],
+        )
+        return {libro.id: cantidad for libro, cantidad in grupos}
+
+    def init(self):
+        # Índice de texto completo: título, autor, género y resumen, en ese orden de peso
+        self.env.cr.execute(SQL("ALTER TABLE biblioteca_libro ADD COLUMN IF NOT EXISTS busqueda_tsv tsvector"))
+        create_index(self.env.cr, 'biblioteca_libro_busqueda_tsv_idx', self._table, ['busqueda_tsv'], method='gin')
+        self._actualizar_busqueda_sql(SQL("l.busqueda_tsv IS NULL"))
+        # Paginación por cursor del catálogo público (título, id)
+        create_index(self.env.cr, 'biblioteca_libro_titulo_id_idx', self._table, ['titulo', 'id'])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        libros = super().create(vals_list)
+        libros._actualizar_busqueda()
+        libros._invalidar_opac(estructura=True)
+        return libros
+
+    def write(self, vals):
+        res = super().write(vals)
+        if CAMPOS_BUSQUEDA_LIBRO & set(vals):
+            self._actualizar_busqueda()
+        self._invalidar_opac(estructura='titulo' in vals)
+        return res
+
+    def unlink(self):
+        self._invalidar_opac(estructura=True)
+        return super().unlink()
+
+    def _invalidar_opac(self, estructura=False):
+        """Saca del cache del catálogo público las páginas de estos libros al confirmar la transacción."""
+        # Un solo callback por transacción que junta los libros de todas las llamadas
+        cr = self.env.cr
+        pendiente = cr.postcommit.data.get('biblioteca.opac')
+        if pendiente is None:
+            pendiente = cr.postcommit.data['biblioteca.opac'] = {'ids': set(), 'estructura': False}
+            base = cr.dbname
+            cr.postcommit.add(lambda: cache_opac.invalidar(base, pendiente['ids'], pendiente['estructura']))
+        pendiente['ids'].update(self.ids)
+        pendiente['estructura'] = pendiente['estructura'] or estructura
+
+    @api.model
+    def pagina_opac(self, despues=None, limite=50):
+        """
+        Página del catálogo público ordenada por título, a partir del libro ``despues``
+        (paginación por cursor: no recorre las páginas anteriores como haría OFFSET).
+        Devuelve (libros, siguiente) donde ``siguiente`` es el cursor de la próxima página o None.
+        """
+        condicion = SQL("TRUE")
+        if despues:
+            condicion = SQL("(l.titulo, l.id) > (SELECT c.titulo, c.id FROM biblioteca_libro c WHERE c.id = %s)",
+                            despues)
+        self.env.cr.execute(SQL("""
+            SELECT l.id FROM biblioteca_libro l
+             WHERE l.titulo IS NOT NULL AND %s
+             ORDER BY l.titulo, l.id
+             LIMIT %s
+        """, condicion, limite + 1))
+        ids = [fila[0] for fila in self.env.cr.fetchall()]
+        libros = self.browse(ids[:limite])
+        return libros, (libros[-1].id if len(ids) > limite else None)
+
+    def _ultima_modificacion_opac(self):
+        """Fecha del último cambio de cada libro o de alguno de sus préstamos: {libro_id: fecha}."""
+        fechas = {libro.id: libro.write_date for libro in self}
+        grupos = self.env['biblioteca.prestamo']._read_group(
+            [('libro_id', 'in', self.ids)], ['libro_id'], ['write_date:max'])
+        for libro, fecha in grupos:
+            if fecha and fecha > fechas[libro.id]:
+                fechas[libro.id] = fecha
+        return fechas
+
+    def _actualizar_busqueda(self):
+        if self.ids:
+            self.flush_recordset(list(CAMPOS_BUSQUEDA_LIBRO))
+            self.env['biblioteca.autor'].flush_model(['display_name'])
+            self._actualizar_busqueda_sql(SQL("l.id IN %s", tuple(self.ids)))
+
+    @api.model
+    def _actualizar_busqueda_sql(self, condicion):
+        """Recalcula el vector de búsqueda de los libros que cumplen ``condicion`` (alias ``l``)."""
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_libro l
+               SET busqueda_tsv = setweight(to_tsvector('spanish', COALESCE(l.titulo, '')), 'A')
+                               || setweight(to_tsvector('spanish', COALESCE(
+                                      (SELECT a.display_name FROM biblioteca_autor a WHERE a.id = l.autor), '')), 'B')
+                               || setweight(to_tsvector('spanish', COALESCE(l.genero, '')), 'C')
+                               || setweight(to_tsvector('spanish', COALESCE(l.description, '')), 'D')
+             WHERE %s
+        """, condicion))
+
+    @api.model
+    def _consulta_catalogo(self, texto, domain=None, limit=None, order=None):
+        """
+        Consulta de libros que coinciden con ``texto`` por texto completo, por
+        fragmento del título o, si pg_trgm está disponible, por parecido del
+        título. Sin ``order`` se ordena por relevancia.
+        """
+        query = self._search(domain or [], limit=limit, order=order)
+        tsquery = SQL("plainto_tsquery('spanish', %s)", texto)
+        if self.env.registry.has_trigram:
+            query.add_where(SQL("(biblioteca_libro.busqueda_tsv @@ %s OR biblioteca_libro.titulo ILIKE %s "
+                                "OR biblioteca_libro.titulo %% %s)", tsquery, f"%{texto}%", texto))
+            relevancia = SQL("ts_rank(biblioteca_libro.busqueda_tsv, %s) + similarity(biblioteca_libro.titulo, %s) DESC, "
+                             "biblioteca_libro.id", tsquery, texto)
+        else:
+            query.add_where(SQL("(biblioteca_libro.busqueda_tsv @@ %s OR biblioteca_libro.titulo ILIKE %s)",
+                                tsquery, f"%{texto}%"))
+            relevancia = SQL("ts_rank(biblioteca_libro.busqueda_tsv, %s) DESC, biblioteca_libro.id", tsquery)
+        if not order:
+            query.order = relevancia
+        return query
+
+    @api.model
+    def buscar_catalogo(self, texto, limit=20):
+        """Búsqueda del catálogo para el mostrador o clientes RPC, con la relevancia de cada libro."""
+        if not texto:
+            return []
+        query = self._consulta_catalogo(texto, limit=limit)
+        libros = self.browse(query.get_result_ids())
+        return [{
+            'id': libro.id,
+            'titulo': libro.titulo,
+            'autor': libro.autor.display_name or '',
+            'ejemplares_disponibles': libro.ejemplares_disponibles,
+        } for libro in libros]
+
+    @api.model
+    def _name_search(self, name, domain=None, operator='ilike', limit=None, order=None):
+        if not name or operator != 'ilike':
+            return super()._name_search(name, domain, operator, limit, order)
+        return self._consulta_catalogo(name, domain, limit, order)
+
+    def _bloquear_para_prestamo(self):
+        """
+        Bloquea las filas de los libros hasta el fin de la transacción para que
+        dos workers no presten el mismo ejemplar. Si otro worker ya actualizó el
+        libro, PostgreSQL lanza un error de serialización y Odoo reintenta la petición.
+        """
+        if not self.ids:
+            return
+        # Orden fijo por id para evitar deadlocks entre préstamos de varios libros
+        self.env.cr.execute(SQL(
+            "SELECT id FROM biblioteca_libro WHERE id IN %s ORDER BY id FOR UPDATE",
+            tuple(self.ids),
+        ))
+        self.invalidate_recordset(['ejemplares', 'ejemplares_disponibles'])
+
     def action_buscar_openlibrary(self):
+        cliente = self.env['biblioteca.openlibrary.cache']._get_cliente()
         for record in self:
             if not record.firstname:
                 raise UserError("Por favor, ingrese un nombre en 'Nombre de búsqueda' antes de buscar en OpenLibrary.")
             try:
-                url = f"https://openlibrary.org/search.json?q={record.firstname}&language=spa"
-                response = requests.get(url, timeout=8)
-                response.raise_for_status()
-                data = response.json()
-                if not data.get('docs'):
+                datos = record._datos_catalogo_local(record.firstname) or datos_libro(cliente, record.firstname)
+                if not datos:
                     raise UserError("No se encontró ningún libro con ese nombre en OpenLibrary.")
-                libro = data['docs'][0]
-                work_key = libro.get('key')
-                titulo = libro.get('title', 'Sin título')
-                autor_nombre = libro.get('author_name', ['Desconocido'])[0]
-                anio = libro.get('first_publish_year')
-                editorial_nombre = libro.get('publisher', ['Desconocido'])[0]
-                paginas = 0
-                descripcion = ''
-                generos = []
-                isbn = libro.get('isbn', [None])[0] if libro.get('isbn') else None
-
-                if work_key:
-                    work_url = f"https://openlibrary.org{work_key}.json"
-                    work_resp = requests.get(work_url, timeout=10)
-                    if work_resp.ok:
-                        work_data = work_resp.json()
-                        if isinstance(work_data.get('description'), dict):
-                            descripcion = work_data['description'].get('value', '')
-                        elif isinstance(work_data.get('description'), str):
-                            descripcion = work_data['description']
-                        if work_data.get('subjects'):
-                            generos = work_data['subjects'][:3]
-                        editions_url = f"https://openlibrary.org{work_key}/editions.json"
-                        editions_resp = requests.get(editions_url, timeout=10)
-                        if editions_resp.ok:
-                            editions_data = editions_resp.json()
-                            if editions_data.get('entries'):
-                                entry = editions_data['entries'][0]
-                                paginas = entry.get('number_of_pages', 0)
-                                isbn = entry.get('isbn_10', [None])[0] if entry.get('isbn_10') else isbn
-                                editorial_nombre = entry.get('publishers', [None])[0] if entry.get('publishers') else editorial_nombre
-
-                autor = self.env['biblioteca.autor'].search([('firstname', '=', autor_nombre)], limit=1)
-                if not autor:
-                    autor = self.env['biblioteca.autor'].create({'firstname': autor_nombre})
-                editorial = self.env['biblioteca.editorial'].search([('name', '=', editorial_nombre)], limit=1)
-                if not editorial:
-                    editorial = self.env['biblioteca.editorial'].create({'name': editorial_nombre})
-
-                record.write({
-                    'titulo': titulo,
-                    'autor': autor.id,
-                    'isbn': isbn or 'No disponible',
-                    'paginas': paginas or 0,
-                    'fecha_publicacion': datetime.strptime(str(anio), '%Y').date() if anio else None,
-                    'description': descripcion or 'No hay descripción disponible.',
-                    'editorial': editorial.id,
-                    'genero': ', '.join(generos) if generos else 'Desconocido',
-                })
+                record.write(record._valores_openlibrary(datos))
             except Exception as e:
                 raise UserError(f"Error al conectar con OpenLibrary: {str(e)}")
 
+    def action_enriquecer_openlibrary(self):
+        """Acción masiva: completa los libros seleccionados y notifica el resultado."""
+        resultados = self._enriquecer_openlibrary()
+        errores = {libro_id: error for libro_id, error in resultados.items() if error}
+        mensaje = f"{len(resultados) - len(errores)} libros actualizados, {len(errores)} con errores."
+        if errores:
+            detalle = [f"{libro.titulo or libro.firstname or libro.id}: {errores[libro.id]}"
+                       for libro in self.browse(list(errores))[:10]]
+            mensaje += "\n" + "\n".join(detalle)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': "Enriquecimiento desde OpenLibrary",
+                'message': mensaje,
+                'type': 'warning' if errores else 'success',
+                'sticky': bool(errores),
+            },
+        }
+
+    def _enriquecer_openlibrary(self, lote=200):
+        """
+        Consulta OpenLibrary en paralelo para todos los libros y aplica los
+        resultados desde el hilo principal. Devuelve {libro_id: error o False}.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        hilos = int(params.get_param('biblioteca.openlibrary_hilos', 8))
+        por_segundo = float(params.get_param('biblioteca.openlibrary_peticiones_segundo', 5))
+        cliente = self.env['biblioteca.openlibrary.cache']._get_cliente(
+            persistente=False, limitador=LimitadorTasa(por_segundo))
+
+        resultados = {libro.id: "Sin nombre de búsqueda" for libro in self if not libro.firstname}
+        con_nombre = self.filtered('firstname')
+        consultas = {}
+        for texto in set(con_nombre.mapped('firstname')):
+            datos = self._datos_catalogo_local(texto)
+            if datos:
+                consultas[texto] = (datos, None)
+        pendientes = [texto for texto in con_nombre.mapped('firstname') if texto not in consultas]
+        consultas.update(datos_libros_en_paralelo(cliente, pendientes, hilos=hilos))
+
+        # Autores, editoriales e ISBN ya tomados de todo el lote se resuelven de una vez
+        encontrados = [datos for datos, error in consultas.values() if datos]
+        autores = self.env['biblioteca.autor'].resolver_nombres([datos['autor_nombre'] for datos in encontrados])
+        editoriales = self.env['biblioteca.editorial'].resolver_nombres(
+            [datos['editorial_nombre'] for datos in encontrados])
+        isbn_tomados = self._isbn13_tomados([datos['isbn'] for datos in encontrados])
+
+        for i in range(0, len(con_nombre), lote):
+            # Los libros que reciben exactamente los mismos valores se escriben juntos
+            grupos = defaultdict(list)
+            for libro in con_nombre[i:i + lote]:
+                datos, error = consultas[libro.firstname]
+                if error:
+                    resultados[libro.id] = f"Error al conectar con OpenLibrary: {error}"
+                elif not datos:
+                    resultados[libro.id] = "No se encontró ningún libro con ese nombre en OpenLibrary."
+                else:
+                    valores = libro._valores_openlibrary(datos, autores, editoriales, isbn_tomados)
+                    grupos[tuple(sorted(valores.items()))].append(libro.id)
+                    resultados[libro.id] = False
+            for valores, ids in grupos.items():
+                self.browse(ids).write(dict(valores))
+            self.env.flush_all()
+        _logger.info(f"OpenLibrary: {sum(1 for e in resultados.values() if not e)} libros enriquecidos, "
+                     f"{sum(1 for e in resultados.values() if e)} con errores")
+        return resultados
+
+    def _datos_catalogo_local(self, texto):
+        """
+        Busca ``texto`` en las obras importadas de los dumps de OpenLibrary y
+        devuelve los datos con el mismo formato que ``datos_libro``, o None.
+        """
+        dominio = [('openlibrary_key', '!=', False), ('id', 'not in', self.ids)]
+        local = (self.search(dominio + [('titulo', '=ilike', texto)], limit=1)
+                 or self.search(dominio + [('titulo', 'ilike', texto)], limit=1))
+        if not local:
+            return None
+        return {
+            'titulo': local.titulo,
+            'autor_nombre': local.autor.firstname or 'Desconocido',
+            'anio': local.fecha_publicacion.year if local.fecha_publicacion else None,
+            'editorial_nombre': local.editorial.name or 'Desconocido',
+            'paginas': local.paginas,
+            'descripcion': local.description or '',
+            'generos': local.genero.split(', ') if local.genero else [],
+            'isbn': local.isbn,
+        }
+
+    def _isbn13_tomados(self, codigos):
+        """{isbn13: id del libro que lo tiene} para los códigos dados, con una sola consulta."""
+        isbn13s = {normalizar_isbn(codigo) for codigo in codigos} - {False, None}
+        if not isbn13s:
+            return {}
+        libros = self.search_fetch([('isbn13', 'in', list(isbn13s))], ['isbn13'])
+        return {libro.isbn13: libro.id for libro in libros}
+
+    def _valores_openlibrary(self, datos, autores=None, editoriales=None, isbn_tomados=None):
+        """
+        Convierte los datos obtenidos de OpenLibrary en valores para write().
+        En un lote, los mapas de nombres y de ISBN tomados llegan ya resueltos;
+        ``isbn_tomados`` se actualiza con el ISBN que se asigna a este libro.
+        """
+        self.ensure_one()
+        if autores is None:
+            autores = self.env['biblioteca.autor'].resolver_nombres([datos['autor_nombre']])
+        if editoriales is None:
+            editoriales = self.env['biblioteca.editorial'].resolver_nombres([datos['editorial_nombre']])
+        if isbn_tomados is None:
+            isbn_tomados = self._isbn13_tomados([datos['isbn']])
+        anio = datos['anio']
+        isbn13 = normalizar_isbn(datos['isbn'])
+        isbn = datos['isbn'] if isbn13 else False
+        # Si otro libro ya tiene este ISBN no se copia: el ISBN-13 es único
+        if isbn and isbn_tomados.setdefault(isbn13, self.id) != self.id:
+            isbn = False
+        return {
+            'titulo': datos['titulo'],
+            'autor': autores.get(datos['autor_nombre']) or False,
+            'isbn': isbn,
+            'paginas': datos['paginas'] or 0,
+            'fecha_publicacion': datetime.strptime(str(anio), '%Y').date() if anio else None,
+            'description': datos['descripcion'] or 'No hay descripción disponible.',
+            'editorial': editoriales.get(datos['editorial_nombre']) or False,
+            'genero': ', '.join(datos['generos']) if datos['generos'] else 'Desconocido',
+        }
+
 
 class BibliotecaUsuario(models.Model):
     _name = 'biblioteca.usuario'
@@ -137,11 +631,13 @@ class BibliotecaUsuario(models.Model):
     _rec_name = 'name'
 
     name = fields.Char(string='Nombre Completo', required=True)
-    cedula = fields.Char(string='Cédula', size=10)
+    cedula = fields.Char(string='Cédula', size=10, index=True)
     email = fields.Char(string='Email')
     phone = fields.Char(string='Teléfono')
     
     prestamo_ids = fields.One2many('biblioteca.prestamo', 'usuario_id', string='Préstamos Realizados')
+    prestamo_abierto_ids = fields.One2many('biblioteca.prestamo', 'usuario_id', string='Préstamos Abiertos',
+                                           domain=[('estado', '!=', 'd')])
     multa_ids = fields.One2many('biblioteca.multa', 'usuario_id', string='Multas')
 
     prestamo_count = fields.Integer(string='Número de Préstamos', compute='_compute_prestamo_count', store=True)
@@ -150,19 +646,39 @@ class BibliotecaUsuario(models.Model):
 
     @api.depends('prestamo_ids')
     def _compute_prestamo_count(self):
+        # Un solo read_group para todo el lote, sin cargar el historial de préstamos
+        conteos = self._contar_por_usuario('biblioteca.prestamo', [])
+        archivados = self._contar_por_usuario('biblioteca.prestamo.archivo', [])
         for record in self:
-            record.prestamo_count = len(record.prestamo_ids)
+            record.prestamo_count = conteos.get(record._origin.id, 0) + archivados.get(record._origin.id, 0)
 
     @api.depends('multa_ids.state')
     def _compute_multa_pendiente_count(self):
+        conteos = self._contar_por_usuario('biblioteca.multa', [('state', '=', 'pendiente')])
         for record in self:
-            record.multa_pendiente_count = len(record.multa_ids.filtered(lambda m: m.state == 'pendiente'))
+            record.multa_pendiente_count = conteos.get(record._origin.id, 0)
 
     # NUEVO: Compute para el bloqueo del usuario
     @api.depends('multa_pendiente_count')
     def _compute_bloqueado_prestamo(self):
+        # Solo cambia el valor de los lectores cuyo contador pasó por cero
         for record in self:
-            record.bloqueado_prestamo = record.multa_pendiente_count > 0
+            bloqueado = record.multa_pendiente_count > 0
+            if record.bloqueado_prestamo != bloqueado or not record._origin:
+                record.bloqueado_prestamo = bloqueado
+
+    def action_ver_historial(self):
+        self.ensure_one()
+        return self.env['biblioteca.prestamo.historial'].accion_historial(
+            [('usuario_id', '=', self.id)], f"Préstamos de {self.name}")
+
+    def _contar_por_usuario(self, modelo, dominio):
+        """Devuelve {usuario_id: cantidad} de ``modelo`` con un read_group por lote."""
+        ids = self._origin.ids
+        if not ids:
+            return {}
+        grupos = self.env[modelo]._read_group(dominio + [('usuario_id', 'in', ids)], ['usuario_id'], ['__count'])
+        return {usuario.id: cantidad for usuario, cantidad in grupos}
 
     @api.constrains('cedula')
     def _check_cedula(self):
@@ -229,19 +745,64 @@ class BibliotecaConfiguracion(models.Model):
     email_biblioteca = fields.Char(string='Email de la Biblioteca', 
                                    default='biblioteca@ejemplo.com',
                                    help='Email desde el cual se enviarán las notificaciones')
+    dias_archivo_prestamos = fields.Integer(string='Días para Archivar Préstamos', default=365, required=True,
+                                            help='Los préstamos devueltos hace más de estos días pasan al archivo '
+                                                 'histórico. 0 desactiva el archivo.')
 
     @api.model
     def get_config(self):
-        config = self.search([], limit=1)
-        if not config:
-            config = self.create({
+        return self.browse(self.get_parametros().id)
+
+    @api.model
+    def get_parametros(self):
+        """
+        Devuelve una copia inmutable de la configuración, servida desde la cache
+        del registro; los bucles pueden usarla sin volver a pasar por el ORM.
+        """
+        parametros = self._get_parametros_cache()
+        if parametros is None:
+            self.sudo().create({
                 'name': 'Configuración de Biblioteca',
                 'dias_prestamo': 7,
                 'dias_gracia_notificacion': 1,
                 'monto_multa_dia': 1.0,
                 'email_biblioteca': 'biblioteca@ejemplo.com'
             })
-        return config
+            parametros = self._get_parametros_cache()
+        return parametros
+
+    @api.model
+    @tools.ormcache()
+    def _get_parametros_cache(self):
+        config = self.sudo().search([], limit=1)
+        if not config:
+            return None
+        return ParametrosBiblioteca(
+            id=config.id,
+            dias_prestamo=config.dias_prestamo,
+            dias_gracia_notificacion=config.dias_gracia_notificacion,
+            monto_multa_dia=config.monto_multa_dia,
+            email_biblioteca=config.email_biblioteca,
+            dias_archivo_prestamos=config.dias_archivo_prestamos,
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env.registry.clear_cache()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self.env.registry.clear_cache()
+        cambia_plazo = 'dias_prestamo' in vals and any(c.dias_prestamo != vals['dias_prestamo'] for c in self)
+        res = super().write(vals)
+        if cambia_plazo:
+            # Los préstamos abiertos se recalculan por lotes en segundo plano
+            self.env['biblioteca.prestamo']._programar_recalculo_fechas_maximas()
+        return res
+
+    def unlink(self):
+        self.env.registry.clear_cache()
+        return super().unlink()
 
 
 class BibliotecaPrestamo(models.Model):
@@ -252,16 +813,20 @@ class BibliotecaPrestamo(models.Model):
     name = fields.Char(string='Prestamo', required=True, copy=False)
     fecha_prestamo = fields.Datetime(default=fields.Datetime.now, string='Fecha de Préstamo')
     libro_id = fields.Many2one('biblioteca.libro', string='Libro', required=True)
-    usuario_id = fields.Many2one('biblioteca.usuario', string='Usuario', required=True)
+    usuario_id = fields.Many2one('biblioteca.usuario', string='Usuario', required=True, index=True)
     email_lector = fields.Char(string='Email del Lector', related='usuario_id.email', store=True, readonly=True)
     fecha_devolucion = fields.Datetime(string='Fecha de Devolución')
     multa_bol = fields.Boolean(default=False, string='Tiene Multa')
     multa = fields.Float(string='Monto Multa', readonly=True)
     fecha_maxima = fields.Datetime(compute='_compute_fecha_maxima', store=True, string='Fecha Máxima de Devolución')
     usuario = fields.Many2one('res.users', string='Usuario presta', default=lambda self: self.env.uid)
-    dias_retraso = fields.Integer(string='Días de Retraso', compute='_compute_dias_retraso', store=True)
+    dias_retraso = fields.Integer(string='Días de Retraso', compute='_compute_dias_retraso',
+                                  search='_search_dias_retraso')
     notificacion_enviada = fields.Boolean(string='Notificación Enviada', default=False)
     fecha_notificacion = fields.Datetime(string='Fecha de Notificación', readonly=True)
+    fecha_proximo_devengo = fields.Datetime(string='Próximo Cargo de Multa', readonly=True, copy=False,
+                                            help="Cuándo la multa por retraso suma un día más. Vacío si el "
+                                                 "préstamo no acumula multa.")
 
     estado = fields.Selection([
         ('b', 'Borrador'),
@@ -270,29 +835,41 @@ class BibliotecaPrestamo(models.Model):
         ('d', 'Devuelto')
     ], string='Estado', default='b')
 
+    def init(self):
+        for nombre, columnas, condicion in INDICES_PRESTAMO:
+            create_index(self.env.cr, nombre, self._table, columnas, where=condicion)
+        # Los préstamos ya notificados antes de existir la cola entran en ella una vez
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_prestamo SET fecha_proximo_devengo = %s
+             WHERE estado IN ('p', 'm') AND fecha_devolucion IS NULL
+               AND notificacion_enviada AND fecha_proximo_devengo IS NULL
+        """, fields.Datetime.now()))
+
     @api.constrains('libro_id', 'usuario_id', 'estado')
     def _check_prestamo_disponibilidad(self):
-        for rec in self:
-            if rec.estado in ['b', 'p']: # Solo se valida en borrador o al prestar
-                # Restricción Lector: No puede tener multas pendientes
-                if rec.usuario_id.bloqueado_prestamo:
-                    raise ValidationError(f"El usuario {rec.usuario_id.name} tiene multas pendientes y está bloqueado para nuevos préstamos.")
-
-                # Restricción Libro: No puede estar Dañado o Perdido
-                if rec.libro_id.bloqueado:
-                    raise ValidationError(f"El libro '{rec.libro_id.titulo}' está bloqueado porque fue reportado como {rec.libro_id.multa_bloqueo_id.tipo_multa.capitalize()} en el préstamo {rec.libro_id.multa_bloqueo_id.prestamo_id.name}.")
-
-                # Restricción de stock, si aplica
-                prestamos_activos = self.search_count([
-                    ('libro_id', '=', rec.libro_id.id),
-                    ('estado', 'in', ['p', 'm']) # Consideramos prestado/multado como fuera de stock
-                ])
-                if prestamos_activos >= rec.libro_id.ejemplares:
-                    raise ValidationError(f"No hay ejemplares disponibles de '{rec.libro_id.titulo}'.")
+        por_validar = self.filtered(lambda r: r.estado in ['b', 'p']) # Solo se valida en borrador o al prestar
+        # Leer el contador almacenado recalcula todos los libros afectados de una sola vez
+        por_validar.libro_id.mapped('ejemplares_disponibles')
+        for rec in por_validar:
+            # Restricción Lector: No puede tener multas pendientes
+            if rec.usuario_id.bloqueado_prestamo:
+                raise ValidationError(f"El usuario {rec.usuario_id.name} tiene multas pendientes y está bloqueado para nuevos préstamos.")
+
+            # Restricción Libro: No puede estar Dañado o Perdido
+            if rec.libro_id.bloqueado:
+                multa = rec.libro_id.multa_bloqueo_id
+                prestamo = multa.prestamo_id.name or multa.prestamo_archivo_id.name
+                raise ValidationError(f"El libro '{rec.libro_id.titulo}' está bloqueado porque fue reportado como {multa.tipo_multa.capitalize()} en el préstamo {prestamo}.")
+
+            # Restricción de stock: un préstamo prestado ya está descontado del contador,
+            # uno en borrador todavía necesita un ejemplar libre
+            minimo = 0 if rec.estado == 'p' else 1
+            if rec.libro_id.ejemplares_disponibles < minimo:
+                raise ValidationError(f"No hay ejemplares disponibles de '{rec.libro_id.titulo}'.")
 
     @api.depends('fecha_prestamo')
     def _compute_fecha_maxima(self):
-        config = self.env['biblioteca.configuracion'].get_config()
+        config = self.env['biblioteca.configuracion'].get_parametros()
         for record in self:
             if record.fecha_prestamo:
                 record.fecha_maxima = record.fecha_prestamo + timedelta(days=config.dias_prestamo)
@@ -301,43 +878,274 @@ class BibliotecaPrestamo(models.Model):
 
     @api.depends('fecha_maxima', 'fecha_devolucion', 'estado')
     def _compute_dias_retraso(self):
+        # No se almacena: se calcula al leer, así nunca queda desactualizado
+        fecha_actual = fields.Datetime.now()
         for record in self:
-            if record.estado in ['p', 'm'] and record.fecha_maxima:
-                fecha_actual = fields.Datetime.now()
-                if fecha_actual > record.fecha_maxima:
-                    diferencia = fecha_actual - record.fecha_maxima
-                    record.dias_retraso = diferencia.days
-                else:
-                    record.dias_retraso = 0
-            elif record.estado == 'd' and record.fecha_devolucion and record.fecha_maxima:
-                if record.fecha_devolucion > record.fecha_maxima:
-                    diferencia = record.fecha_devolucion - record.fecha_maxima
-                    record.dias_retraso = diferencia.days
-                else:
-                    record.dias_retraso = 0
+            referencia = record.fecha_devolucion or (fecha_actual if record.estado in ['p', 'm'] else False)
+            if record.estado != 'b' and referencia and record.fecha_maxima and referencia > record.fecha_maxima:
+                record.dias_retraso = (referencia - record.fecha_maxima).days
             else:
                 record.dias_retraso = 0
 
     @api.model
+    def _sql_dias_retraso(self, alias):
+        """Expresión SQL equivalente a ``_compute_dias_retraso`` para buscar y ordenar."""
+        return SQL("""GREATEST(COALESCE(date_part('day',
+                        CASE WHEN %(t)s.estado IN ('p', 'm', 'd')
+                             THEN COALESCE(%(t)s.fecha_devolucion,
+                                           CASE WHEN %(t)s.estado IN ('p', 'm') THEN %(ahora)s::timestamp END)
+                        END - %(t)s.fecha_maxima), 0), 0)::int""",
+                   t=SQL.identifier(alias), ahora=fields.Datetime.now())
+
+    def _search_dias_retraso(self, operator, value):
+        if operator not in ('=', '!=', '<', '<=', '>', '>=') or not isinstance(value, int):
+            raise UserError(f"Operación no soportada para los días de retraso: {operator} {value}")
+        query = self._search([])
+        query.add_where(SQL("%s %s %s", self._sql_dias_retraso(self._table), SQL(operator), value))
+        return [('id', 'in', query)]
+
+    def _order_field_to_sql(self, alias, field_name, direction, nulls, query):
+        if field_name == 'dias_retraso':
+            return SQL("%s %s %s", self._sql_dias_retraso(alias), direction, nulls)
+        return super()._order_field_to_sql(alias, field_name, direction, nulls, query)
+
     @api.model
+    @perfilado
+    def _cron_actualizar_montos_retraso(self):
+        """
+        Recalcula en una sola sentencia los días y montos de las multas por retraso
+        pendientes de los préstamos que siguen sin devolverse.
+        """
+        inicio = time.perf_counter()
+        monto_multa_dia = self.env['biblioteca.configuracion'].get_parametros().monto_multa_dia
+        self.env.flush_all()
+        self.env.cr.execute(SQL("""
+            WITH atrasados AS (
+                SELECT p.id, %(dias)s AS dias
+                  FROM biblioteca_prestamo p
+                 WHERE p.estado IN ('p', 'm')
+                   AND p.fecha_devolucion IS NULL
+                   AND p.fecha_maxima < %(ahora)s
+            ), multas AS (
+                UPDATE biblioteca_multa m
+                   SET dias_retraso = a.dias,
+                       monto = a.dias * %(monto)s,
+                       write_date = %(ahora)s
+                  FROM atrasados a
+                 WHERE m.prestamo_id = a.id
+                   AND m.tipo_multa = 'retraso'
+                   AND m.state = 'pendiente'
+                   AND m.dias_retraso IS DISTINCT FROM a.dias
+             RETURNING m.prestamo_id, m.monto
+            )
+            UPDATE biblioteca_prestamo p
+               SET multa = multas.monto,
+                   write_date = %(ahora)s
+              FROM multas
+             WHERE p.id = multas.prestamo_id
+        """, dias=self._sql_dias_retraso('p'), ahora=fields.Datetime.now(), monto=monto_multa_dia))
+        actualizados = self.env.cr.rowcount
+        self.env['biblioteca.multa'].invalidate_model(['dias_retraso', 'monto'])
+        self.invalidate_model(['multa'])
+        _logger.info(f"Montos de multas por retraso actualizados en {actualizados} préstamos")
+        metricas.al_confirmar(self.env.cr, metricas.CRON_PRESTAMOS.inc, actualizados, cron='montos_retraso')
+        self._registrar_ejecucion_cron('montos_retraso', inicio)
+        return actualizados
+
+    @api.model_create_multi
+    @perfilado
     def create(self, vals_list):
-        # El método create recibe una lista de diccionarios (vals_list)
-        # Iteramos sobre la lista
-        for vals in vals_list:
-            # Aplicamos la secuencia a cada diccionario 'vals' individual
-            if not vals.get('name'):
-                vals['name'] = self.env['ir.sequence'].next_by_code('biblioteca.prestamo') or '/'
-        
-        # Llamamos al super() original con la lista de diccionarios modificada
-        return super().create(vals_list)
+        # Las referencias de todo el lote se reservan juntas, con una sola consulta
+        sin_nombre = [vals for vals in vals_list if not vals.get('name')]
+        nombres = self.env['ir.sequence'].next_block_by_code('biblioteca.prestamo', len(sin_nombre))
+        for vals, nombre in zip(sin_nombre, nombres or ['/'] * len(sin_nombre)):
+            vals['name'] = nombre
+
+        prestamos = super().create(vals_list)
+        prestamos.libro_id._invalidar_opac()
+        prestamos._revisar_marca_vencidos()
+        return prestamos
+
+    def write(self, vals):
+        # La disponibilidad que muestra el catálogo público depende del estado y del libro
+        if {'estado', 'libro_id'} & set(vals):
+            self.libro_id._invalidar_opac()
+        res = super().write(vals)
+        if 'libro_id' in vals:
+            self.libro_id._invalidar_opac()
+        if {'estado', 'fecha_prestamo', 'fecha_maxima', 'notificacion_enviada'} & set(vals):
+            self._revisar_marca_vencidos()
+        return res
+
+    def _revisar_marca_vencidos(self):
+        """
+        Un préstamo que pasa a prestado con la fecha máxima ya detrás de la marca
+        del cron de vencidos (borrador antiguo, fecha atrasada) no lo vería la
+        búsqueda incremental: se baja la marca para que entre en la próxima ejecución.
+        """
+        pendientes = self.filtered(lambda p: p.estado == 'p' and not p.notificacion_enviada and p.fecha_maxima)
+        if pendientes:
+            self._bajar_marca_vencidos(min(pendientes.mapped('fecha_maxima')))
+
+    @api.model
+    def _bajar_marca_vencidos(self, fecha_maxima):
+        # La marca nunca pasa de la hora de la ejecución: una fecha futura no puede quedar detrás
+        if fecha_maxima <= fields.Datetime.now():
+            self.env['biblioteca.cron.estado'].bajar_marca(MARCA_VENCIDOS, fecha_maxima - timedelta(seconds=1))
 
+    def unlink(self):
+        self.libro_id._invalidar_opac()
+        return super().unlink()
+
+    @perfilado
     def generar_prestamo(self):
-        for rec in self:
-            rec.write({'estado': 'p'})
-            return True
+        with metricas.CIRCULACION_SEGUNDOS.medir(operacion='prestar', canal='accion'):
+            self.libro_id._bloquear_para_prestamo()
+            self.write({'estado': 'p'})
+        metricas.al_confirmar(self.env.cr, metricas.CIRCULACION.inc, len(self),
+                              operacion='prestar', canal='accion', resultado='ok')
+        return True
+
+    @api.model
+    def prestar_libro(self, libro_id, usuario_id):
+        """
+        Crea un préstamo ya prestado reservando el ejemplar de forma atómica.
+        Pensado para los mostradores y clientes RPC; devuelve el id del préstamo.
+        """
+        libro = self.env['biblioteca.libro'].browse(libro_id)
+        try:
+            libro._bloquear_para_prestamo()
+            with metricas.CIRCULACION_SEGUNDOS.medir(operacion='prestar', canal='rpc'):
+                prestamo = self.create([{
+                    'libro_id': libro.id,
+                    'usuario_id': usuario_id,
+                    'estado': 'p',
+                }])
+        except (UserError, ValidationError):
+            # La transacción se deshace: el error se cuenta ya, no al confirmar
+            metricas.CIRCULACION.inc(operacion='prestar', canal='rpc', resultado='error')
+            raise
+        metricas.al_confirmar(self.env.cr, metricas.CIRCULACION.inc, operacion='prestar', canal='rpc', resultado='ok')
+        return prestamo.id
+
+    @api.model
+    @perfilado
+    def circulacion(self, cedula, isbns, operacion='prestar'):
+        """
+        Presta o devuelve en una sola transacción los libros escaneados por un
+        lector. Cada ISBN se procesa por separado: un error se informa en su
+        resultado sin deshacer el resto. Devuelve el estado del lector y, por
+        cada ISBN, el resultado y la disponibilidad del libro.
+        """
+        if operacion not in ('prestar', 'devolver'):
+            raise UserError(f"Operación de circulación desconocida: {operacion}")
+        inicio = time.perf_counter()
+        usuario = self.env['biblioteca.usuario'].search([('cedula', '=', cedula)], limit=1) if cedula else False
+        if not usuario:
+            raise UserError(f"No existe un lector con la cédula {cedula}.")
+
+        libros = self.env['biblioteca.libro']._buscar_por_isbns(isbns)
+        if operacion == 'prestar':
+            libros_validos = self.env['biblioteca.libro'].union(*libros.values())
+            libros_validos._bloquear_para_prestamo()
+            resultados = self._circulacion_prestar(usuario, isbns, libros)
+        else:
+            resultados = self._circulacion_devolver(usuario, isbns, libros)
+
+        self.env.flush_all()
+        usuario.invalidate_recordset(['multa_pendiente_count', 'bloqueado_prestamo'])
+        montos = self.env['biblioteca.multa']._read_group(
+            [('usuario_id', '=', usuario.id), ('state', '=', 'pendiente')], [], ['monto:sum'])
+        for resultado in resultados:
+            libro = libros.get(resultado['isbn'])
+            if libro:
+                resultado['libro'] = libro.titulo
+                resultado['ejemplares_disponibles'] = libro.ejemplares_disponibles
+        for ok, cantidad in Counter(resultado['ok'] for resultado in resultados).items():
+            metricas.al_confirmar(self.env.cr, metricas.CIRCULACION.inc, cantidad, operacion=operacion,
+                                  canal='mostrador', resultado='ok' if ok else 'error')
+        metricas.CIRCULACION_SEGUNDOS.observar(time.perf_counter() - inicio, operacion=operacion, canal='mostrador')
+        return {
+            'usuario': {
+                'id': usuario.id,
+                'nombre': usuario.name,
+                'bloqueado': usuario.bloqueado_prestamo,
+                'multas_pendientes': usuario.multa_pendiente_count,
+                'monto_pendiente': montos[0][0] or 0.0,
+            },
+            'resultados': resultados,
+        }
+
+    def _circulacion_prestar(self, usuario, isbns, libros):
+        resultados = []
+        reservados = defaultdict(int)
+        # Se recorre la lista escaneada: el mismo ISBN puede venir varias veces
+        for isbn in isbns:
+            libro = libros[isbn]
+            if not libro:
+                resultados.append({'isbn': isbn, 'ok': False, 'error': "ISBN no encontrado en el catálogo."})
+            elif usuario.bloqueado_prestamo:
+                resultados.append({'isbn': isbn, 'ok': False,
+                                   'error': "El lector tiene multas pendientes y está bloqueado para nuevos préstamos."})
+            elif libro.bloqueado:
+                resultados.append({'isbn': isbn, 'ok': False, 'error': "El libro está bloqueado por una multa."})
+            elif libro.ejemplares_disponibles - reservados[libro.id] < 1:
+                resultados.append({'isbn': isbn, 'ok': False, 'error': "No hay ejemplares disponibles."})
+            else:
+                reservados[libro.id] += 1
+                resultados.append({'isbn': isbn, 'ok': True})
+
+        aceptados = [resultado for resultado in resultados if resultado['ok']]
+        # Los libros ya están bloqueados y validados: un solo create para todo el lote
+        prestamos = self.create([{
+            'libro_id': libros[resultado['isbn']].id,
+            'usuario_id': usuario.id,
+            'estado': 'p',
+        } for resultado in aceptados])
+        for resultado, prestamo in zip(aceptados, prestamos):
+            resultado.update({
+                'prestamo': prestamo.name,
+                'fecha_maxima': fields.Datetime.to_string(prestamo.fecha_maxima),
+            })
+        return resultados
+
+    def _circulacion_devolver(self, usuario, isbns, libros):
+        abiertos = defaultdict(lambda: self.browse())
+        for prestamo in self.search([
+            ('usuario_id', '=', usuario.id),
+            ('libro_id', 'in', [libro.id for libro in libros.values() if libro]),
+            ('estado', 'in', ['p', 'm']),
+            ('fecha_devolucion', '=', False),
+        ], order='fecha_prestamo, id'):
+            abiertos[prestamo.libro_id.id] |= prestamo
 
+        resultados = []
+        for isbn in isbns:
+            libro = libros[isbn]
+            prestamo = abiertos[libro.id][:1] if libro else self.browse()
+            if not libro:
+                resultados.append({'isbn': isbn, 'ok': False, 'error': "ISBN no encontrado en el catálogo."})
+            elif not prestamo:
+                resultados.append({'isbn': isbn, 'ok': False, 'error': "El lector no tiene este libro prestado."})
+            else:
+                abiertos[libro.id] -= prestamo
+                # Cada devolución en su savepoint: un error deshace solo la de este ISBN
+                try:
+                    with self.env.cr.savepoint():
+                        # circulacion ya mide y cuenta cada ISBN en el canal del mostrador
+                        prestamo.with_context(biblioteca_canal='mostrador').action_devolver()
+                except (UserError, ValidationError) as e:
+                    resultados.append({'isbn': isbn, 'ok': False, 'error': str(e)})
+                    continue
+                resultados.append({'isbn': isbn, 'ok': True, 'prestamo': prestamo.name,
+                                   'dias_retraso': prestamo.dias_retraso, 'multa': prestamo.multa})
+        return resultados
+
+    @perfilado
     def action_devolver(self):
         """Registra la devolución y genera multa si hay retraso"""
+        inicio = time.perf_counter()
+        con_retraso = 0
         for rec in self:
             fecha_devolucion = fields.Datetime.now()
             
@@ -345,34 +1153,34 @@ class BibliotecaPrestamo(models.Model):
                 # CREACIÓN DE MULTA POR RETRASO
                 diferencia = fecha_devolucion - rec.fecha_maxima
                 dias_retraso = diferencia.days
-                config = self.env['biblioteca.configuracion'].get_config()
-                monto_multa_dia = config.monto_multa_dia
+                monto_multa_dia = self.env['biblioteca.configuracion'].get_parametros().monto_multa_dia
                 monto_total = dias_retraso * monto_multa_dia
 
+                # Crea la multa por retraso o actualiza la que dejó el cron
                 rec._generar_multa_automatica(dias_retraso, monto_multa_dia)
-                
-                self.env['biblioteca.multa'].create({
-                    'usuario_id': rec.usuario_id.id,
-                    'prestamo_id': rec.id,
-                    'monto': monto_total,
-                    'dias_retraso': dias_retraso,
-                    'fecha_vencimiento': fecha_devolucion.date() + timedelta(days=30),
-                    'state': 'pendiente'
-                })
-                
+
                 rec.write({
                     'fecha_devolucion': fecha_devolucion,
                     'estado': 'm', # Estado de Multa
                     'multa_bol': True,
-                    'multa': monto_total # Usar el monto total recalculado
+                    'multa': monto_total, # Usar el monto total recalculado
+                    'fecha_proximo_devengo': False,
                 })
+                con_retraso += 1
             else:
                 rec.write({
                     'fecha_devolucion': fecha_devolucion,
                     'estado': 'd',
                     'multa_bol': False,
-                    'multa': 0.0
+                    'multa': 0.0,
+                    'fecha_proximo_devengo': False,
                 })
+        if self.env.context.get('biblioteca_canal') != 'mostrador':
+            metricas.CIRCULACION_SEGUNDOS.observar(time.perf_counter() - inicio, operacion='devolver', canal='accion')
+            metricas.al_confirmar(self.env.cr, metricas.CIRCULACION.inc, len(self),
+                                  operacion='devolver', canal='accion', resultado='ok')
+        metricas.al_confirmar(self.env.cr, metricas.DEVOLUCIONES.inc, con_retraso, resultado='con_retraso')
+        metricas.al_confirmar(self.env.cr, metricas.DEVOLUCIONES.inc, len(self) - con_retraso, resultado='a_tiempo')
     # NUEVO: Botón para reportar Dañado
     def action_reportar_danado(self):
         return self._generar_multa_manual('danado')
@@ -381,15 +1189,16 @@ class BibliotecaPrestamo(models.Model):
     def action_reportar_perdido(self):
         return self._generar_multa_manual('perdido')
     
+    @perfilado
     def _generar_multa_manual(self, tipo):
         """Genera multa manual (Dañado o Perdido)"""
         self.ensure_one()
-        config = self.env['biblioteca.configuracion'].get_config()
-        
+
         # Monto para multas Dañado/Perdido: Usaremos el costo del libro o un valor fijo
         monto = self.libro_id.costo or 50.0 # Usar el costo del libro como base
         dias_retraso = 0
 
+        metricas.al_confirmar(self.env.cr, metricas.MULTAS_CREADAS.inc, tipo=tipo)
         multa = self.env['biblioteca.multa'].create({
             'usuario_id': self.usuario_id.id,
             'prestamo_id': self.id,
@@ -407,7 +1216,8 @@ class BibliotecaPrestamo(models.Model):
             'fecha_devolucion': fields.Datetime.now(),
             'estado': 'm', # Estado de Multa
             'multa_bol': True,
-            'multa': monto
+            'multa': monto,
+            'fecha_proximo_devengo': False,
         })
         
         # Opcional: Enviar notificación específica para daño/pérdida
@@ -417,42 +1227,286 @@ class BibliotecaPrestamo(models.Model):
 
 
     @api.model
-    def _cron_verificar_prestamos_vencidos(self):
+    @perfilado
+    def _cron_verificar_prestamos_vencidos(self, batch_size=500):
+        """
+        Cron incremental de vencidos, pensado para correr cada pocos minutos:
+
+        1. Multa y avisa los préstamos cuya fecha máxima (más los días de gracia)
+           pasó desde la marca de agua de la ejecución anterior, no todos los vencidos.
+        2. Sube un día las multas de la cola de devengo: solo los préstamos cuyo
+           próximo cargo ya llegó.
+
+        Ambas partes van por lotes con un commit por lote. El avance de la primera
+        se guarda en un checkpoint para retomar una ejecución interrumpida.
+        """
         _logger.info("=== INICIANDO VERIFICACIÓN DE PRÉSTAMOS VENCIDOS ===")
-        
-        config = self.env['biblioteca.configuracion'].get_config()
-        fecha_actual = fields.Datetime.now()
-        
-        prestamos_vencidos = self.search([
+        inicio = time.perf_counter()
+
+        config = self.env['biblioteca.configuracion'].get_parametros()
+        fecha_actual, ultimo_id = self._leer_checkpoint_vencidos()
+        if fecha_actual:
+            _logger.info(f"Reanudando verificación desde el préstamo con id > {ultimo_id}")
+        else:
+            fecha_actual, ultimo_id = fields.Datetime.now(), 0
+
+        # Los días de gracia se filtran en la consulta y no en Python
+        limite_gracia = fecha_actual - timedelta(days=config.dias_gracia_notificacion)
+        domain = [
             ('estado', '=', 'p'),
             ('fecha_maxima', '<', fecha_actual),
+            ('fecha_maxima', '<=', limite_gracia),
             ('notificacion_enviada', '=', False),
-        ])
-        
-        _logger.info(f"Préstamos vencidos encontrados: {len(prestamos_vencidos)}")
-        
-        for prestamo in prestamos_vencidos:
+        ]
+        Estado = self.env['biblioteca.cron.estado']
+        marca, cambios = Estado.leer_marca(MARCA_VENCIDOS)
+        if marca:
+            # Lo anterior a la marca ya se revisó; sin marca se revisa todo una vez
+            domain.append(('fecha_maxima', '>', marca))
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+
+        procesados = 0
+        while True:
+            lote = self.search(domain + [('id', '>', ultimo_id)], order='id', limit=batch_size)
+            if not lote:
+                break
+            lote._procesar_lote_vencidos(fecha_actual, config)
+            ultimo_id = lote[-1].id
+            procesados += len(lote)
+            self._guardar_checkpoint_vencidos(fecha_actual, ultimo_id)
+            metricas.al_confirmar(self.env.cr, metricas.CRON_PRESTAMOS.inc, len(lote), cron='vencidos')
+            if auto_commit:
+                self.env.cr.commit()
+            self.env.invalidate_all()
+            _logger.info(f"Lote procesado: {len(lote)} préstamos (total {procesados})")
+
+        # Si alguien bajó o quitó la marca mientras tanto, se respeta para la siguiente ejecución
+        Estado.subir_marca(MARCA_VENCIDOS, limite_gracia, cambios)
+        self._guardar_checkpoint_vencidos(False, 0)
+        devengados = self._devengar_multas_retraso(config.monto_multa_dia, batch_size, auto_commit)
+        _logger.info(f"=== VERIFICACIÓN COMPLETADA: {procesados} préstamos vencidos procesados, "
+                     f"{devengados} multas devengadas ===")
+        self._registrar_ejecucion_cron('vencidos', inicio)
+        return procesados
+
+    @api.model
+    def _devengar_multas_retraso(self, monto_multa_dia, batch_size, auto_commit):
+        """
+        Actualiza los días y el monto de la multa por retraso de los préstamos
+        cuyo próximo cargo ya llegó, y les programa el siguiente. Un préstamo que
+        ya no está abierto sale de la cola. Devuelve cuántos préstamos se revisaron.
+        """
+        self.env.flush_all()
+        revisados = 0
+        while True:
+            ahora = fields.Datetime.now()
+            self.env.cr.execute(SQL("""
+                WITH debidos AS (
+                    SELECT id, fecha_maxima,
+                           estado IN ('p', 'm') AND fecha_devolucion IS NULL AS abierto,
+                           GREATEST(date_part('day', %(ahora)s - fecha_maxima), 0)::int AS dias
+                      FROM biblioteca_prestamo
+                     WHERE fecha_proximo_devengo <= %(ahora)s
+                     ORDER BY fecha_proximo_devengo
+                     LIMIT %(lote)s
+                       FOR UPDATE SKIP LOCKED
+                ), multas AS (
+                    UPDATE biblioteca_multa m
+                       SET dias_retraso = d.dias,
+                           monto = d.dias * %(monto)s,
+                           write_date = %(ahora)s
+                      FROM debidos d
+                     WHERE d.abierto
+                       AND m.prestamo_id = d.id
+                       AND m.tipo_multa = 'retraso'
+                       AND m.state = 'pendiente'
+                       AND m.dias_retraso IS DISTINCT FROM d.dias
+                 RETURNING m.prestamo_id, m.monto
+                )
+                UPDATE biblioteca_prestamo p
+                   SET fecha_proximo_devengo = CASE WHEN d.abierto
+                                                    THEN d.fecha_maxima + interval '1 day' * (d.dias + 1) END,
+                       multa = COALESCE(multas.monto, p.multa),
+                       write_date = %(ahora)s
+                  FROM debidos d
+                  LEFT JOIN multas ON multas.prestamo_id = d.id
+                 WHERE p.id = d.id
+            """, ahora=ahora, lote=batch_size, monto=monto_multa_dia))
+            cantidad = self.env.cr.rowcount
+            revisados += cantidad
+            metricas.al_confirmar(self.env.cr, metricas.CRON_PRESTAMOS.inc, cantidad, cron='devengo')
+            if auto_commit:
+                self.env.cr.commit()
+            if cantidad < batch_size:
+                break
+        self.env['biblioteca.multa'].invalidate_model(['dias_retraso', 'monto'])
+        self.invalidate_model(['multa', 'fecha_proximo_devengo'])
+        return revisados
+
+    def _programar_devengo(self, fecha_actual):
+        """Pone los préstamos en la cola de devengo, con el cargo del día siguiente al de ``fecha_actual``."""
+        if not self.ids:
+            return
+        self.flush_recordset(['fecha_maxima'])
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_prestamo
+               SET fecha_proximo_devengo = fecha_maxima + interval '1 day'
+                                           * (GREATEST(date_part('day', %s - fecha_maxima), 0)::int + 1)
+             WHERE id IN %s AND fecha_maxima IS NOT NULL
+        """, fecha_actual, tuple(self.ids)))
+        self.invalidate_recordset(['fecha_proximo_devengo'])
+
+    @api.model
+    def _registrar_ejecucion_cron(self, cron, inicio):
+        metricas.CRON_SEGUNDOS.observar(time.perf_counter() - inicio, cron=cron)
+        metricas.al_confirmar(self.env.cr, metricas.CRON_ULTIMA_EJECUCION.set, time.time(), cron=cron)
+
+    @api.model
+    def _programar_recalculo_fechas_maximas(self):
+        """Deja pendiente el recálculo desde el primer préstamo y despierta al cron."""
+        dias = self.env['biblioteca.configuracion'].get_parametros().dias_prestamo
+        self.env['biblioteca.cron.estado'].guardar(CHECKPOINT_FECHAS_MAXIMAS, f"{dias}|0")
+        self.env.ref('biblioteca.cron_recalcular_fechas_maximas').sudo()._trigger()
+
+    @api.model
+    @perfilado
+    def _cron_recalcular_fechas_maximas(self, batch_size=5000):
+        """
+        Recalcula la fecha máxima de los préstamos abiertos (prestados o con multa)
+        con el plazo actual, por lotes de ids y un UPDATE por lote, con commit y
+        checkpoint entre lotes. Los préstamos devueltos, o con multa pero ya
+        cerrados, conservan su fecha.
+        No hace nada si no hay un recálculo pendiente.
+        """
+        Estado = self.env['biblioteca.cron.estado']
+        valor = Estado.leer(CHECKPOINT_FECHAS_MAXIMAS)
+        if not valor:
+            return 0
+        inicio = time.perf_counter()
+        dias = self.env['biblioteca.configuracion'].get_parametros().dias_prestamo
+        dias_checkpoint, ultimo_id = (int(parte) for parte in valor.split('|'))
+        if dias_checkpoint != dias:
+            # El plazo volvió a cambiar: se empieza de nuevo con el valor vigente
+            ultimo_id = 0
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+
+        self.env.flush_all()
+        self.env.cr.execute(SQL(
+            """SELECT count(*) FROM biblioteca_prestamo
+                WHERE estado IN ('p', 'm') AND fecha_devolucion IS NULL AND id > %s""", ultimo_id))
+        total = self.env.cr.fetchone()[0]
+        _logger.info(f"Recalculando la fecha máxima de {total} préstamos abiertos con {dias} días de plazo")
+
+        procesados = actualizados = 0
+        while True:
+            self.env.cr.execute(SQL("""
+                SELECT id FROM biblioteca_prestamo
+                 WHERE estado IN ('p', 'm') AND fecha_devolucion IS NULL AND id > %s
+                 ORDER BY id LIMIT %s
+            """, ultimo_id, batch_size))
+            ids = [fila[0] for fila in self.env.cr.fetchall()]
+            if not ids:
+                break
+            self.env.cr.execute(SQL("""
+                UPDATE biblioteca_prestamo
+                   SET fecha_maxima = fecha_prestamo + interval '1 day' * %(dias)s,
+                       fecha_proximo_devengo = CASE WHEN fecha_proximo_devengo IS NOT NULL THEN %(ahora)s END,
+                       write_date = %(ahora)s
+                 WHERE id IN %(ids)s
+                   AND estado IN ('p', 'm')
+                   AND fecha_devolucion IS NULL
+                   AND fecha_prestamo IS NOT NULL
+                   AND fecha_maxima IS DISTINCT FROM fecha_prestamo + interval '1 day' * %(dias)s
+            """, dias=dias, ahora=fields.Datetime.now(), ids=tuple(ids)))
+            actualizados += self.env.cr.rowcount
+            procesados += len(ids)
+            ultimo_id = ids[-1]
+            Estado.guardar(CHECKPOINT_FECHAS_MAXIMAS, f"{dias}|{ultimo_id}")
+            metricas.al_confirmar(self.env.cr, metricas.CRON_PRESTAMOS.inc, len(ids), cron='fechas_maximas')
+            if auto_commit:
+                self.env.cr.commit()
+            _logger.info(f"Fechas máximas: {procesados}/{total} préstamos revisados, {actualizados} actualizados")
+
+        self.invalidate_model(['fecha_maxima', 'fecha_proximo_devengo'])
+        Estado.guardar(CHECKPOINT_FECHAS_MAXIMAS, False)
+        # Las fechas máximas cambiaron por debajo de la marca: el cron de vencidos vuelve a revisar todo
+        Estado.bajar_marca(MARCA_VENCIDOS)
+        _logger.info(f"Recálculo de fechas máximas completado: {actualizados} préstamos actualizados")
+        self._registrar_ejecucion_cron('fechas_maximas', inicio)
+        return actualizados
+
+    @api.model
+    def _leer_checkpoint_vencidos(self):
+        valor = self.env['biblioteca.cron.estado'].leer(CHECKPOINT_VENCIDOS)
+        if not valor:
+            return False, 0
+        fecha, ultimo_id = valor.split('|')
+        return fields.Datetime.to_datetime(fecha), int(ultimo_id)
+
+    @api.model
+    def _guardar_checkpoint_vencidos(self, fecha_actual, ultimo_id):
+        valor = f"{fields.Datetime.to_string(fecha_actual)}|{ultimo_id}" if fecha_actual else False
+        self.env['biblioteca.cron.estado'].guardar(CHECKPOINT_VENCIDOS, valor)
+
+    @perfilado
+    def _procesar_lote_vencidos(self, fecha_actual, config):
+        """
+        Genera o actualiza las multas por retraso de un lote de préstamos
+        con una sola búsqueda, un create masivo y writes agrupados por valores.
+        """
+        Multa = self.env['biblioteca.multa']
+        multa_por_prestamo = {}
+        for multa in Multa.search([
+            ('prestamo_id', 'in', self.ids),
+            ('tipo_multa', '=', 'retraso'),
+            ('state', '=', 'pendiente'),
+        ]):
+            multa_por_prestamo.setdefault(multa.prestamo_id.id, multa)
+
+        fecha_vencimiento = fields.Date.today() + timedelta(days=30)
+        valores_nuevas = []
+        multas_por_valores = defaultdict(lambda: Multa)
+        prestamos_por_monto = defaultdict(lambda: self.browse())
+        for prestamo in self:
             dias_retraso = (fecha_actual - prestamo.fecha_maxima).days
-            
-            if dias_retraso >= config.dias_gracia_notificacion:
-                _logger.info(f"Procesando préstamo {prestamo.name} - Retraso: {dias_retraso} días")
-                
-                multa = prestamo._generar_multa_automatica(dias_retraso, config)
-                
-                if prestamo.email_lector:
-                    prestamo._enviar_correo_multa(multa, config)
-                else:
-                    _logger.warning(f"Préstamo {prestamo.name} no tiene email")
-                
-                prestamo.write({
-                    'estado': 'm',
-                    'multa_bol': True,
-                    'notificacion_enviada': True,
-                    'fecha_notificacion': fecha_actual
+            monto = dias_retraso * config.monto_multa_dia
+            prestamos_por_monto[monto] |= prestamo
+            multa = multa_por_prestamo.get(prestamo.id)
+            if multa:
+                multas_por_valores[(dias_retraso, monto)] |= multa
+            else:
+                valores_nuevas.append({
+                    'usuario_id': prestamo.usuario_id.id,
+                    'prestamo_id': prestamo.id,
+                    'tipo_multa': 'retraso',
+                    'monto': monto,
+                    'dias_retraso': dias_retraso,
+                    'fecha_vencimiento': fecha_vencimiento,
+                    'state': 'pendiente',
                 })
-        
-        _logger.info("=== VERIFICACIÓN COMPLETADA ===")
 
+        for (dias_retraso, monto), multas in multas_por_valores.items():
+            multas.write({'dias_retraso': dias_retraso, 'monto': monto})
+        nuevas = Multa.create(valores_nuevas)
+        for multa in nuevas:
+            multa_por_prestamo[multa.prestamo_id.id] = multa
+        metricas.al_confirmar(self.env.cr, metricas.MULTAS_CREADAS.inc, len(nuevas), tipo='retraso')
+
+        for monto, prestamos in prestamos_por_monto.items():
+            prestamos.write({
+                'estado': 'm',
+                'multa_bol': True,
+                'multa': monto,
+                'notificacion_enviada': True,
+                'fecha_notificacion': fecha_actual,
+            })
+        self._programar_devengo(fecha_actual)
+
+        self._enviar_correos_multa()
+
+        _logger.info(f"Multas por retraso: {len(nuevas)} creadas, {len(self) - len(nuevas)} actualizadas")
+
+    @perfilado
     def _generar_multa_automatica(self, dias_retraso, monto_multa_dia):
         """
         Crea o actualiza una multa de tipo 'retraso' para el préstamo actual.
@@ -494,24 +1548,51 @@ class BibliotecaPrestamo(models.Model):
             
             # Actualizar el campo 'multa' en el registro de préstamo (se hace en el else/creación)
             self.write({'multa': monto_actualizado})
+            metricas.al_confirmar(self.env.cr, metricas.MULTAS_CREADAS.inc, tipo='retraso')
             _logger.info(f"Nueva multa por retraso creada {multa.name} - Monto: ${monto_actualizado}")
             return multa
 
-    def _enviar_correo_multa(self, multa, config):
-        try:
-            template = self.env.ref('biblioteca.email_template_notificacion_multa', raise_if_not_found=False)
-            
+    @perfilado
+    def _enviar_correos_multa(self):
+        """
+        Encola las notificaciones de multa sin esperar al servidor SMTP: un correo
+        por préstamo, o un único resumen para el lector que tiene varios préstamos
+        en el lote. Las plantillas se renderizan en lote y la cola de correo de Odoo
+        se encarga del envío. Devuelve el número de correos encolados.
+        """
+        for prestamo in self.filtered(lambda p: not p.email_lector):
+            _logger.warning(f"Préstamo {prestamo.name} no tiene email")
+
+        prestamos_por_usuario = defaultdict(lambda: self.browse())
+        for prestamo in self.filtered('email_lector'):
+            prestamos_por_usuario[prestamo.usuario_id] |= prestamo
+        individuales = self.browse()
+        usuarios_resumen = self.env['biblioteca.usuario']
+        for usuario, prestamos in prestamos_por_usuario.items():
+            if len(prestamos) == 1:
+                individuales |= prestamos
+            else:
+                usuarios_resumen |= usuario
+
+        encolados = 0
+        for xmlid, registros in [('biblioteca.email_template_notificacion_multa', individuales),
+                                 ('biblioteca.email_template_resumen_multas', usuarios_resumen)]:
+            if not registros:
+                continue
+            template = self.env.ref(xmlid, raise_if_not_found=False)
             if not template:
-                _logger.error("Plantilla de correo no encontrada")
-                return False
-            
-            template.send_mail(self.id, force_send=True)
-            _logger.info(f"Correo enviado a {self.email_lector} para préstamo {self.name}")
-            return True
-            
-        except Exception as e:
-            _logger.error(f"Error al enviar correo para préstamo {self.name}: {str(e)}")
-            return False
+                _logger.error(f"Plantilla de correo {xmlid} no encontrada")
+                continue
+            try:
+                template.send_mail_batch(registros.ids, force_send=False)
+                encolados += len(registros)
+            except Exception as e:
+                _logger.error(f"Error al encolar correos de multa ({xmlid}): {str(e)}")
+
+        _logger.info(f"Correos de multa encolados: {encolados} "
+                     f"({len(individuales)} individuales, {len(usuarios_resumen)} resúmenes)")
+        metricas.al_confirmar(self.env.cr, metricas.CORREOS_ENCOLADOS.inc, encolados)
+        return encolados
 
 
 class BibliotecaMulta(models.Model):
@@ -519,11 +1600,12 @@ class BibliotecaMulta(models.Model):
     _description = 'Multa por Retraso de Libro'
     _rec_name = 'name'
 
-    name = fields.Char(string='Referencia de Multa', 
-                      default=lambda self: self.env['ir.sequence'].next_by_code('biblioteca.multa'), 
-                      readonly=True)
+    name = fields.Char(string='Referencia de Multa', readonly=True, copy=False)
     usuario_id = fields.Many2one('biblioteca.usuario', string='Lector Multado', required=True)
-    prestamo_id = fields.Many2one('biblioteca.prestamo', string='Préstamo Origen', required=True, ondelete='restrict')
+    prestamo_id = fields.Many2one('biblioteca.prestamo', string='Préstamo Origen', ondelete='restrict')
+    # Cuando el préstamo se archiva la multa pasa a apuntar a su copia en el archivo
+    prestamo_archivo_id = fields.Many2one('biblioteca.prestamo.archivo', string='Préstamo Archivado',
+                                          readonly=True, ondelete='restrict', index='btree_not_null')
     tipo_multa = fields.Selection([
         ('retraso', 'Retraso'),
         ('danado', 'Dañado'),
@@ -539,17 +1621,66 @@ class BibliotecaMulta(models.Model):
         ('cancelada', 'Cancelada')
     ], string='Estado', default='pendiente', required=True)
 
+    _sql_constraints = [
+        ('prestamo_requerido', 'CHECK(prestamo_id IS NOT NULL OR prestamo_archivo_id IS NOT NULL)',
+         'La multa debe tener un préstamo de origen.'),
+    ]
+
+    def init(self):
+        for nombre, columnas, condicion in INDICES_MULTA:
+            create_index(self.env.cr, nombre, self._table, columnas, where=condicion)
+
+    @api.model_create_multi
+    @perfilado
+    def create(self, vals_list):
+        # Igual que en los préstamos: una sola reserva de referencias para todo el lote
+        sin_nombre = [vals for vals in vals_list if not vals.get('name')]
+        nombres = self.env['ir.sequence'].next_block_by_code('biblioteca.multa', len(sin_nombre))
+        for vals, nombre in zip(sin_nombre, nombres or ['/'] * len(sin_nombre)):
+            vals['name'] = nombre
+        return super().create(vals_list)
+
     def action_pagar(self):
-        self.ensure_one()
-        self.state = 'pagada'
-        
-       #al pagar se revisa si debemos liberar al libro o al usuario para que no este en perdio
-        if self.tipo_multa in ['perdido', 'danado'] and self.prestamo_id.libro_id.multa_bloqueo_id == self: #el and revisa si es esta la multa que causa el vloqueo
-            # Liberar el libro pq estaba perdido o dañado
-            self.prestamo_id.libro_id.write({'multa_bloqueo_id': False}) 
-        
-        # se pasa a estado d, osea devuelto
-        if self.prestamo_id.fecha_devolucion or self.tipo_multa in ['perdido', 'danado']:
-            self.prestamo_id.write({'estado': 'd'})
-        
-        _logger.info(f"Multa {self.name} marcada como pagada")
\ No newline at end of file
+        """Registra el pago de las multas seleccionadas (una o varias)."""
+        self._pagar()
+        return True
+
+    @api.model
+    def pagar_multas(self, multa_ids):
+        """
+        API para pagar varias multas de una vez. Devuelve cuántas multas se pagaron,
+        cuántos libros y lectores quedaron libres y cuántos préstamos se cerraron.
+        """
+        return self.browse(multa_ids).exists()._pagar()
+
+    @perfilado
+    def _pagar(self):
+        # Pagar cada multa por separado repetía las mismas escrituras por registro;
+        # aquí cada tabla se actualiza una sola vez para todo el lote
+        por_pagar = self.filtered(lambda m: m.state == 'pendiente')
+        if not por_pagar:
+            return {'pagadas': 0, 'libros_liberados': 0, 'prestamos_cerrados': 0, 'lectores_desbloqueados': 0}
+        lectores_bloqueados = por_pagar.usuario_id.filtered('bloqueado_prestamo')
+        por_pagar.write({'state': 'pagada'})
+
+        # Se libera el libro solo si es esta multa la que lo tiene bloqueado (dañado o perdido)
+        libros = self.env['biblioteca.libro'].search([('multa_bloqueo_id', 'in', por_pagar.ids)])
+        libros.write({'multa_bloqueo_id': False})
+
+        # Se pasa a estado d, osea devuelto, si ya se devolvió o el libro se dio por dañado o perdido
+        prestamos = por_pagar.filtered(
+            lambda m: m.prestamo_id.fecha_devolucion or m.tipo_multa in ['perdido', 'danado']
+        ).prestamo_id.filtered(lambda p: p.estado != 'd')
+        prestamos.write({'estado': 'd'})
+
+        # El contador de multas pendientes se recalcula una vez por lector afectado
+        self.env.flush_all()
+        desbloqueados = lectores_bloqueados.filtered(lambda u: not u.bloqueado_prestamo)
+        _logger.info(f"{len(por_pagar)} multas pagadas: {len(libros)} libros liberados, "
+                     f"{len(prestamos)} préstamos cerrados, {len(desbloqueados)} lectores desbloqueados")
+        return {
+            'pagadas': len(por_pagar),
+            'libros_liberados': len(libros),
+            'prestamos_cerrados': len(prestamos),
+            'lectores_desbloqueados': len(desbloqueados),
+        }
\ No newline at end of file
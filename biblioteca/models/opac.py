@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+import time
+
+from .openlibrary import CacheLRU
+
+# Segundos que una página del catálogo público puede servirse sin volver a la base.
+# Acota lo que tarda en verse un cambio hecho desde otro worker.
+TTL_PAGINAS_OPAC = 60
+
+
+class CachePaginasOpac:
+    """
+    Páginas del catálogo público ya renderizadas, junto con los libros que muestran.
+    Una página deja de servirse en cuanto cambia alguno de sus libros (o sus préstamos)
+    o cuando se crean, borran o renombran libros, porque eso mueve la paginación.
+    """
+
+    def __init__(self, max_entradas=2000):
+        self._paginas = CacheLRU(max_entradas)
+        self._contador = itertools.count(1)
+        # {(base, libro_id): (marca del último cambio, instante)}; libro_id None = cambio de estructura.
+        # En orden de marca: los más viejos se podan por delante
+        self._cambios = {}
+        # Marca del último cambio podado: una página anterior a él ya no se puede validar
+        self._podado = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        """Marca a tomar ANTES de leer los datos de una página que se va a guardar."""
+        with self._lock:
+            return next(self._contador)
+
+    def obtener(self, base, clave):
+        entrada = self._paginas.obtener((base, clave))
+        if entrada is None:
+            return None
+        version, ids, valor = entrada
+        with self._lock:
+            if version < self._podado or any(self._cambios.get((base, libro_id), (0,))[0] > version
+                                             for libro_id in (None, *ids)):
+                return None
+        return valor
+
+    def guardar(self, base, clave, version, ids, valor):
+        self._paginas.guardar((base, clave), (version, tuple(ids), valor), TTL_PAGINAS_OPAC)
+
+    def invalidar(self, base, ids=(), estructura=False):
+        claves = [(base, libro_id) for libro_id in ids] + ([(base, None)] if estructura else [])
+        with self._lock:
+            marca = next(self._contador)
+            ahora = time.monotonic()
+            for clave in claves:
+                # Se saca y se vuelve a meter para que quede al final, con los más recientes
+                self._cambios.pop(clave, None)
+                self._cambios[clave] = (marca, ahora)
+            self._podar(ahora)
+
+    def _podar(self, ahora):
+        # Un cambio de hace más de TTL_PAGINAS_OPAC solo afecta a páginas ya vencidas;
+        # las pocas que aún no vencieron se descartan por ``_podado``
+        limite = ahora - TTL_PAGINAS_OPAC
+        while self._cambios:
+            clave, (marca, instante) = next(iter(self._cambios.items()))
+            if instante >= limite:
+                break
+            del self._cambios[clave]
+            self._podado = marca
+
+
+cache_opac = CachePaginasOpac()
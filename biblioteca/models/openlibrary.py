@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .metricas import OPENLIBRARY, OPENLIBRARY_SEGUNDOS
+
+_logger = logging.getLogger(__name__)
+
+URL_OPENLIBRARY = 'https://openlibrary.org'
+TTL_CACHE_DEFECTO = 7 * 24 * 3600  # segundos
+MAX_ENTRADAS_MEMORIA = 2048
+MAX_ENTRADAS_BD = 50000
+
+_sesiones = {}
+_sesiones_lock = threading.Lock()
+
+
+def _get_sesion(base_url):
+    """Una sesión por URL base y proceso, con pool de conexiones y reintentos con backoff."""
+    with _sesiones_lock:
+        sesion = _sesiones.get(base_url)
+        if sesion is None:
+            reintentos = Retry(total=3, backoff_factor=0.5,
+                               status_forcelist=[429, 500, 502, 503, 504],
+                               allowed_methods=['GET'])
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=reintentos)
+            sesion = requests.Session()
+            sesion.mount('http://', adaptador)
+            sesion.mount('https://', adaptador)
+            sesion.headers['User-Agent'] = 'Odoo biblioteca'
+            _sesiones[base_url] = sesion
+        return sesion
+
+
+class CacheLRU:
+    """Cache LRU en memoria con expiración por entrada; segura entre hilos."""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS_MEMORIA):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.time():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (time.time() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+# Compartida por todos los clientes del proceso; las claves incluyen la URL base
+_cache_memoria = CacheLRU()
+
+
+class LimitadorTasa:
+    """Limita las peticiones a ``por_segundo`` entre todos los hilos que lo comparten."""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo else 0.0
+        self._siguiente = 0.0
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+class OpenLibraryClient:
+    """
+    Cliente de la API de OpenLibrary. ``cache`` debe ofrecer ``obtener(clave)`` y
+    ``guardar(clave, valor, ttl)``; por defecto solo se usa la cache en memoria.
+    """
+
+    def __init__(self, base_url=URL_OPENLIBRARY, cache=None, ttl=TTL_CACHE_DEFECTO, timeout=10, limitador=None):
+        self.base_url = base_url.rstrip('/')
+        self.cache = _cache_memoria if cache is None else cache
+        self.ttl = ttl
+        self.timeout = timeout
+        self.limitador = limitador
+        self.sesion = _get_sesion(self.base_url)
+
+    def get_json(self, ruta, params=None, opcional=False):
+        """
+        Devuelve la respuesta JSON de ``ruta``, desde la cache si es posible.
+        Con ``opcional=True`` un error HTTP devuelve None en lugar de lanzar excepción.
+        """
+        url = f"{self.base_url}{ruta}"
+        clave = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        datos = self.cache.obtener(clave)
+        if datos is not None:
+            OPENLIBRARY.inc(resultado='hit')
+            return datos
+        if self.limitador:
+            self.limitador.esperar()
+        try:
+            with OPENLIBRARY_SEGUNDOS.medir():
+                respuesta = self.sesion.get(url, params=params, timeout=self.timeout)
+            respuesta.raise_for_status()
+        except requests.RequestException:
+            OPENLIBRARY.inc(resultado='error')
+            if opcional:
+                return None
+            raise
+        OPENLIBRARY.inc(resultado='miss')
+        datos = respuesta.json()
+        self.cache.guardar(clave, datos, self.ttl)
+        return datos
+
+    def buscar(self, texto):
+        return self.get_json('/search.json', {'q': texto, 'language': 'spa'})
+
+    def obra(self, work_key):
+        return self.get_json(f"{work_key}.json", opcional=True)
+
+    def ediciones(self, work_key):
+        return self.get_json(f"{work_key}/editions.json", opcional=True)
+
+
+def datos_libro(cliente, texto):
+    """
+    Busca ``texto`` en OpenLibrary y devuelve los datos del primer resultado
+    completados con la obra y sus ediciones. No usa el ORM, así que puede
+    ejecutarse fuera del hilo de la petición. Devuelve None si no hay resultados.
+    """
+    data = cliente.buscar(texto)
+    if not data.get('docs'):
+        return None
+    libro = data['docs'][0]
+    work_key = libro.get('key')
+    datos = {
+        'titulo': libro.get('title', 'Sin título'),
+        'autor_nombre': libro.get('author_name', ['Desconocido'])[0],
+        'anio': libro.get('first_publish_year'),
+        'editorial_nombre': libro.get('publisher', ['Desconocido'])[0],
+        'paginas': 0,
+        'descripcion': '',
+        'generos': [],
+        'isbn': libro.get('isbn', [None])[0] if libro.get('isbn') else None,
+    }
+
+    work_data = cliente.obra(work_key) if work_key else None
+    if work_data:
+        if isinstance(work_data.get('description'), dict):
+            datos['descripcion'] = work_data['description'].get('value', '')
+        elif isinstance(work_data.get('description'), str):
+            datos['descripcion'] = work_data['description']
+        if work_data.get('subjects'):
+            datos['generos'] = work_data['subjects'][:3]
+        editions_data = cliente.ediciones(work_key)
+        if editions_data and editions_data.get('entries'):
+            entry = editions_data['entries'][0]
+            datos['paginas'] = entry.get('number_of_pages', 0)
+            if entry.get('isbn_10'):
+                datos['isbn'] = entry['isbn_10'][0]
+            if entry.get('publishers'):
+                datos['editorial_nombre'] = entry['publishers'][0]
+    return datos
+
+
+def datos_libros_en_paralelo(cliente, textos, hilos=8):
+    """
+    Ejecuta ``datos_libro`` para cada texto con un pool de hilos acotado.
+    Devuelve {texto: (datos, error)}; un fallo no interrumpe al resto.
+    El cliente no debe usar una cache respaldada por el ORM.
+    """
+    def consultar(texto):
+        try:
+            return texto, (datos_libro(cliente, texto), None)
+        except Exception as e:
+            return texto, (None, str(e))
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='openlibrary') as pool:
+        return dict(pool.map(consultar, set(textos)))
+
+
+class BibliotecaOpenLibraryCache(models.Model):
+    _name = 'biblioteca.openlibrary.cache'
+    _description = 'Cache de respuestas de OpenLibrary'
+    _rec_name = 'clave'
+    _log_access = False
+
+    clave = fields.Char(string='URL', required=True, index=True)
+    respuesta = fields.Text(string='Respuesta JSON')
+    fecha_expiracion = fields.Datetime(string='Expira', required=True, index=True)
+    ultimo_acceso = fields.Datetime(string='Último Acceso', index=True)
+
+    _sql_constraints = [
+        ('clave_unique', 'unique(clave)', 'Ya existe una respuesta en cache para esta URL.'),
+    ]
+
+    @api.model
+    def obtener(self, clave):
+        datos = _cache_memoria.obtener(clave)
+        if datos is not None:
+            return datos
+        entrada = self.search([('clave', '=', clave), ('fecha_expiracion', '>', fields.Datetime.now())], limit=1)
+        if not entrada:
+            return None
+        entrada.ultimo_acceso = fields.Datetime.now()
+        datos = json.loads(entrada.respuesta)
+        ttl = (entrada.fecha_expiracion - fields.Datetime.now()).total_seconds()
+        _cache_memoria.guardar(clave, datos, ttl)
+        return datos
+
+    @api.model
+    def guardar(self, clave, datos, ttl):
+        _cache_memoria.guardar(clave, datos, ttl)
+        ahora = fields.Datetime.now()
+        # Upsert: otra petición pudo guardar la misma URL en paralelo
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_openlibrary_cache (clave, respuesta, fecha_expiracion, ultimo_acceso)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (clave) DO UPDATE
+               SET respuesta = EXCLUDED.respuesta,
+                   fecha_expiracion = EXCLUDED.fecha_expiracion,
+                   ultimo_acceso = EXCLUDED.ultimo_acceso
+        """, clave, json.dumps(datos), ahora + timedelta(seconds=ttl), ahora))
+        self.invalidate_model()
+
+    @api.model
+    def _get_cliente(self, persistente=True, limitador=None):
+        """
+        Cliente configurado con los parámetros del sistema (URL base y TTL).
+        Con ``persistente=False`` solo usa la cache en memoria y puede usarse desde otros hilos.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        return OpenLibraryClient(
+            base_url=params.get_param('biblioteca.openlibrary_url', URL_OPENLIBRARY),
+            ttl=int(params.get_param('biblioteca.openlibrary_cache_ttl', TTL_CACHE_DEFECTO)),
+            cache=self if persistente else None,
+            limitador=limitador,
+        )
+
+    @api.model
+    def _gc_cache(self, max_entradas=MAX_ENTRADAS_BD):
+        """Elimina las entradas expiradas y las menos usadas por encima del límite."""
+        self.env.cr.execute(SQL("DELETE FROM biblioteca_openlibrary_cache WHERE fecha_expiracion < %s", fields.Datetime.now()))
+        expiradas = self.env.cr.rowcount
+        self.env.cr.execute(SQL("""
+            DELETE FROM biblioteca_openlibrary_cache
+             WHERE id IN (SELECT id FROM biblioteca_openlibrary_cache
+                           ORDER BY ultimo_acceso DESC NULLS LAST OFFSET %s)
+        """, max_entradas))
+        _logger.info(f"Cache OpenLibrary: {expiradas} expiradas y {self.env.cr.rowcount} por límite eliminadas")
+        self.invalidate_model()
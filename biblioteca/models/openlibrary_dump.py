@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import logging
+import threading
+import time
+from datetime import date
+
+from odoo import models, api
+from odoo.tools import SQL
+
+from .models import normalizar_isbn, normalizar_nombre
+from .sql import valores_sql
+
+_logger = logging.getLogger(__name__)
+
+TIPOS_DUMP = {
+    '/type/author': 'autor',
+    '/type/work': 'obra',
+    '/type/edition': 'edicion',
+}
+
+
+def leer_lineas(ruta):
+    """Lee el dump línea por línea, comprimido (.gz) o no, sin cargarlo en memoria."""
+    abrir = gzip.open if ruta.endswith('.gz') else open
+    with abrir(ruta, 'rt', encoding='utf-8') as archivo:
+        yield from archivo
+
+
+def parsear_registros(lineas):
+    """
+    Convierte cada línea en ``(tipo, registro)``. Acepta el formato TSV de los
+    dumps oficiales (tipo, clave, revisión, fecha, json) y JSON por línea.
+    """
+    for linea in lineas:
+        linea = linea.rstrip('\n')
+        if not linea:
+            continue
+        try:
+            if '\t' in linea:
+                linea = linea.split('\t', 4)[4]
+            registro = json.loads(linea)
+        except (IndexError, ValueError):
+            continue
+        tipo = TIPOS_DUMP.get((registro.get('type') or {}).get('key'))
+        if tipo and registro.get('key'):
+            yield tipo, registro
+
+
+def _texto(valor):
+    if isinstance(valor, dict):
+        return valor.get('value')
+    return valor if isinstance(valor, str) else None
+
+
+def _anio(texto):
+    digitos = ''.join(c if c.isdigit() else ' ' for c in texto or '').split()
+    anios = [int(d) for d in digitos if len(d) == 4]
+    return date(anios[0], 1, 1) if anios else None
+
+
+def fila_autor(registro):
+    nombre = (registro.get('name') or registro.get('personal_name') or '').strip()
+    return (registro['key'], nombre[:255], normalizar_nombre(nombre[:255])) if nombre else None
+
+
+def fila_obra(registro):
+    autores = [a.get('author', {}).get('key') for a in registro.get('authors') or [] if isinstance(a, dict)]
+    return (
+        registro['key'],
+        (registro.get('title') or 'Sin título')[:255],
+        _texto(registro.get('description')),
+        ', '.join(registro.get('subjects', [])[:3]) or None,
+        next((a for a in autores if a), None),
+    )
+
+
+def fila_edicion(registro):
+    obras = [w.get('key') for w in registro.get('works') or [] if isinstance(w, dict)]
+    if not obras:
+        return None
+    isbn = (registro.get('isbn_10') or registro.get('isbn_13') or [None])[0]
+    isbn13 = normalizar_isbn(isbn) or None
+    editorial = (registro.get('publishers') or [None])[0]
+    return (
+        obras[0],
+        registro.get('number_of_pages') if isinstance(registro.get('number_of_pages'), int) else None,
+        isbn if isbn13 else None,
+        isbn13,
+        editorial[:255] if editorial else None,
+        normalizar_nombre(editorial[:255]) if editorial else None,
+        _anio(registro.get('publish_date')),
+    )
+
+
+CONVERTIDORES = {'autor': fila_autor, 'obra': fila_obra, 'edicion': fila_edicion}
+
+
+class BibliotecaOpenLibraryDump(models.AbstractModel):
+    _name = 'biblioteca.openlibrary.dump'
+    _description = 'Importador de dumps de OpenLibrary'
+
+    @api.model
+    def importar_dump(self, ruta, lote=5000):
+        """
+        Importa un dump de OpenLibrary (autores, obras o ediciones) en el catálogo local.
+        Conviene importar en ese orden para que las obras encuentren a sus autores.
+        Hace commit por lote y devuelve {tipo: filas} con el total procesado.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        buffers = {tipo: {} for tipo in CONVERTIDORES}
+        totales = dict.fromkeys(CONVERTIDORES, 0)
+        inicio = time.perf_counter()
+        lineas = 0
+
+        def vaciar(tipo):
+            filas = list(buffers[tipo].values())
+            if not filas:
+                return
+            getattr(self, f'_upsert_{tipo}')(filas)
+            buffers[tipo].clear()
+            totales[tipo] += len(filas)
+            if auto_commit:
+                self.env.cr.commit()
+            transcurrido = time.perf_counter() - inicio
+            _logger.info(f"Dump {ruta}: {sum(totales.values())} filas importadas "
+                         f"({sum(totales.values()) / transcurrido:.0f} filas/s, {lineas} líneas leídas)")
+
+        def contar(lineas_archivo):
+            nonlocal lineas
+            for linea in lineas_archivo:
+                lineas += 1
+                yield linea
+
+        for tipo, registro in parsear_registros(contar(leer_lineas(ruta))):
+            fila = CONVERTIDORES[tipo](registro)
+            if not fila:
+                continue
+            # Se indexa por clave para quedarse con una sola fila por obra/autor en el lote
+            buffers[tipo].setdefault(fila[0], fila)
+            if len(buffers[tipo]) >= lote:
+                vaciar(tipo)
+        for tipo in buffers:
+            vaciar(tipo)
+
+        self.env.invalidate_all()
+        self.env['biblioteca.libro']._invalidar_opac(estructura=True)
+        transcurrido = time.perf_counter() - inicio
+        _logger.info(f"Dump {ruta} importado en {transcurrido:.1f}s: {totales} "
+                     f"({sum(totales.values()) / max(transcurrido, 1e-6):.0f} filas/s)")
+        return totales
+
+    def _upsert_autor(self, filas):
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_autor (openlibrary_key, firstname, display_name, nombre_normalizado,
+                                          create_uid, write_uid, create_date, write_date)
+            SELECT v.clave, v.nombre, v.nombre, v.normalizado, %(uid)s, %(uid)s, %(ahora)s, %(ahora)s
+              FROM (VALUES %(valores)s) AS v(clave, nombre, normalizado)
+            ON CONFLICT (openlibrary_key) DO UPDATE
+               SET firstname = EXCLUDED.firstname,
+                   display_name = btrim(EXCLUDED.firstname || ' ' || COALESCE(biblioteca_autor.lastname, '')),
+                   nombre_normalizado = lower(regexp_replace(
+                       btrim(EXCLUDED.firstname || ' ' || COALESCE(biblioteca_autor.lastname, '')), '\\s+', ' ', 'g')),
+                   write_date = EXCLUDED.write_date
+        """, uid=self.env.uid, ahora=self.env.cr.now(), valores=valores_sql(filas)))
+
+    def _upsert_obra(self, filas):
+        # Las obras importadas entran sin ejemplares: son catálogo, no existencias
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_libro (openlibrary_key, titulo, description, genero, autor,
+                                          ejemplares, ejemplares_disponibles, bloqueado,
+                                          create_uid, write_uid, create_date, write_date)
+            SELECT v.clave, v.titulo, v.descripcion, v.genero, a.id, 0, 0, FALSE,
+                   %(uid)s, %(uid)s, %(ahora)s, %(ahora)s
+              FROM (VALUES %(valores)s) AS v(clave, titulo, descripcion, genero, autor_clave)
+              LEFT JOIN biblioteca_autor a ON a.openlibrary_key = v.autor_clave
+            ON CONFLICT (openlibrary_key) DO UPDATE
+               SET titulo = EXCLUDED.titulo,
+                   description = COALESCE(EXCLUDED.description, biblioteca_libro.description),
+                   genero = COALESCE(EXCLUDED.genero, biblioteca_libro.genero),
+                   autor = COALESCE(EXCLUDED.autor, biblioteca_libro.autor),
+                   write_date = EXCLUDED.write_date
+        """, uid=self.env.uid, ahora=self.env.cr.now(), valores=valores_sql(filas)))
+        self.env['biblioteca.libro']._actualizar_busqueda_sql(
+            SQL("l.openlibrary_key IN %s", tuple(fila[0] for fila in filas)))
+
+    def _upsert_edicion(self, filas):
+        # Un mismo ISBN solo puede asignarse a una obra del lote (isbn13 es único)
+        vistos = set()
+        for i, (obra, paginas, isbn, isbn13, editorial, normalizado, fecha) in enumerate(filas):
+            if isbn13 in vistos:
+                filas[i] = (obra, paginas, None, None, editorial, normalizado, fecha)
+            vistos.add(isbn13)
+        valores = valores_sql(filas)
+        self.env.cr.execute(SQL("""
+            INSERT INTO biblioteca_editorial (name, nombre_normalizado, create_uid, write_uid, create_date, write_date)
+            SELECT DISTINCT ON (v.normalizado) v.editorial, v.normalizado, %(uid)s, %(uid)s, %(ahora)s, %(ahora)s
+              FROM (VALUES %(valores)s) AS v(obra, paginas, isbn, isbn13, editorial, normalizado, fecha)
+             WHERE v.normalizado IS NOT NULL
+            ON CONFLICT (nombre_normalizado) DO NOTHING
+        """, uid=self.env.uid, ahora=self.env.cr.now(), valores=valores))
+        # Solo se completan los datos que la obra todavía no tiene
+        self.env.cr.execute(SQL("""
+            UPDATE biblioteca_libro l
+               SET paginas = COALESCE(NULLIF(l.paginas, 0), v.paginas::int),
+                   isbn = CASE WHEN l.isbn IS NULL AND NOT EXISTS (
+                                   SELECT 1 FROM biblioteca_libro x WHERE x.isbn13 = v.isbn13)
+                               THEN v.isbn ELSE l.isbn END,
+                   isbn13 = CASE WHEN l.isbn IS NULL AND NOT EXISTS (
+                                     SELECT 1 FROM biblioteca_libro x WHERE x.isbn13 = v.isbn13)
+                                 THEN v.isbn13 ELSE l.isbn13 END,
+                   fecha_publicacion = COALESCE(l.fecha_publicacion, v.fecha::date),
+                   editorial = COALESCE(l.editorial, e.id),
+                   write_date = %(ahora)s
+              FROM (VALUES %(valores)s) AS v(obra, paginas, isbn, isbn13, editorial, normalizado, fecha)
+              LEFT JOIN biblioteca_editorial e ON e.nombre_normalizado = v.normalizado
+             WHERE l.openlibrary_key = v.obra
+        """, ahora=self.env.cr.now(), valores=valores))
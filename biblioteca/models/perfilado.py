@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .sql import valores_sql
+
+_logger = logging.getLogger(__name__)
+
+# Parámetro del sistema que activa el perfilado ('1' / 'True'); apagado por defecto
+PARAMETRO_PERFILADO = 'biblioteca.perfilado'
+
+# Un método perfilado que se llama esta cantidad de veces dentro de otro es un N+1
+UMBRAL_LLAMADAS_REPETIDAS = 10
+# Más consultas que esto por registro también se marca como N+1 probable
+UMBRAL_CONSULTAS_REGISTRO = 2
+
+# Llamadas medidas y todavía no guardadas, por base; si nadie las vuelca se pierden las más viejas
+MAX_BUFFER = 5000
+VOLCADO_MINIMO = 50
+VOLCADO_SEGUNDOS = 30
+
+_buffers = defaultdict(lambda: deque(maxlen=MAX_BUFFER))
+_ultimo_volcado = defaultdict(float)
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _activo(env):
+    valor = env['ir.config_parameter'].sudo().get_param(PARAMETRO_PERFILADO)
+    return valor in ('1', 'True', 'true')
+
+
+def perfilado(metodo):
+    """
+    Mide tiempo, consultas SQL y tiempo SQL de cada llamada al método cuando el
+    perfilado está activo. Las llamadas anidadas se cuentan por método para
+    detectar N+1: el mismo método perfilado llamado muchas veces dentro de otro.
+    """
+    nombre = metodo.__name__
+
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        pila = getattr(_local, 'pila', None)
+        if pila is None:
+            pila = _local.pila = []
+        if not pila and not _activo(self.env):
+            return metodo(self, *args, **kwargs)
+
+        hilo = threading.current_thread()
+        if not hasattr(hilo, 'query_count'):
+            # El cursor acumula aquí el tiempo SQL si el hilo lo tiene (como en las peticiones HTTP)
+            hilo.query_count, hilo.query_time = 0, 0.0
+        cr = self.env.cr
+        marco = {'hijos': Counter()}
+        pila.append(marco)
+        consultas_inicio, sql_inicio = cr.sql_log_count, hilo.query_time
+        inicio = time.perf_counter()
+        try:
+            return metodo(self, *args, **kwargs)
+        finally:
+            segundos = time.perf_counter() - inicio
+            pila.pop()
+            if pila:
+                pila[-1]['hijos'][f'{self._name}.{nombre}'] += 1
+            consultas = cr.sql_log_count - consultas_inicio
+            avisos = [f"{hijo} llamado {veces} veces" for hijo, veces in marco['hijos'].items()
+                      if veces >= UMBRAL_LLAMADAS_REPETIDAS]
+            if len(self) > 1 and consultas > UMBRAL_CONSULTAS_REGISTRO * len(self):
+                avisos.append(f"{consultas} consultas para {len(self)} registros")
+            with _lock:
+                _buffers[cr.dbname].append((
+                    fields.Datetime.now(), f'{self._name}.{nombre}', self._name, len(self),
+                    segundos, consultas, hilo.query_time - sql_inicio, bool(avisos),
+                    '\n'.join(avisos) or None, self.env.uid,
+                ))
+            if not pila:
+                _volcar(self.env.registry)
+
+    return envoltura
+
+
+def _volcar(registry, forzar=False):
+    """Guarda las llamadas acumuladas con un cursor propio, para no depender de la transacción medida."""
+    if getattr(threading.current_thread(), 'testing', False):
+        return
+    ahora = time.monotonic()
+    with _lock:
+        buffer = _buffers[registry.db_name]
+        if not buffer or not forzar and len(buffer) < VOLCADO_MINIMO \
+                and ahora - _ultimo_volcado[registry.db_name] < VOLCADO_SEGUNDOS:
+            return
+        filas = list(buffer)
+        buffer.clear()
+        _ultimo_volcado[registry.db_name] = ahora
+    try:
+        with registry.cursor() as cr:
+            cr.execute(SQL("""
+                INSERT INTO biblioteca_perfil_llamada (fecha, metodo, modelo, registros, segundos, consultas,
+                                                       segundos_sql, n_mas_1, avisos, usuario_id)
+                VALUES %s
+            """, valores_sql(filas)))
+    except Exception as e:
+        _logger.warning(f"No se pudieron guardar {len(filas)} llamadas perfiladas: {e}")
+
+
+class BibliotecaPerfilLlamada(models.Model):
+    _name = 'biblioteca.perfil.llamada'
+    _description = 'Llamada perfilada de la biblioteca'
+    _order = 'fecha desc, id desc'
+    _log_access = False
+
+    fecha = fields.Datetime(string='Fecha', readonly=True)
+    metodo = fields.Char(string='Método', readonly=True, index=True)
+    modelo = fields.Char(string='Modelo', readonly=True)
+    registros = fields.Integer(string='Registros', readonly=True, aggregator='sum')
+    segundos = fields.Float(string='Tiempo (s)', readonly=True, digits=(16, 4), aggregator='avg')
+    consultas = fields.Integer(string='Consultas SQL', readonly=True, aggregator='avg')
+    segundos_sql = fields.Float(string='Tiempo SQL (s)', readonly=True, digits=(16, 4), aggregator='avg')
+    n_mas_1 = fields.Boolean(string='N+1', readonly=True)
+    avisos = fields.Text(string='Avisos', readonly=True)
+    usuario_id = fields.Many2one('res.users', string='Usuario', readonly=True)
+
+    @api.model
+    def action_volcar(self):
+        """Guarda ya las llamadas que este proceso tiene en memoria."""
+        _volcar(self.env.registry, forzar=True)
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+    @api.model
+    def _gc_perfiles(self, dias=7):
+        """Borra las llamadas perfiladas de más de ``dias`` días."""
+        self.env.cr.execute(SQL("DELETE FROM biblioteca_perfil_llamada WHERE fecha < %s",
+                                fields.Datetime.subtract(fields.Datetime.now(), days=dias)))
+        _logger.info(f"Perfilado: {self.env.cr.rowcount} llamadas antiguas eliminadas")
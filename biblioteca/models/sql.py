@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tools import SQL
+
+
+def valores_sql(filas):
+    """Lista ``(a, b, ...), (c, d, ...)`` de un ``VALUES`` con las filas como parámetros."""
+    return SQL(", ").join(SQL("(%s)", SQL(", ").join(fila)) for fila in filas)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del módulo biblioteca sobre una base Odoo con el módulo instalado.
+
+Genera autores, libros, lectores (con cédulas válidas), historial de préstamos
+y multas en las cantidades indicadas, y mide el tiempo y las consultas SQL de
+los caminos críticos: cron de vencidos, creación masiva de préstamos con su
+restricción, devoluciones, pago de multas y lectura de las vistas de lista.
+
+Todo corre en una sola transacción que se deshace al final (salvo --conservar),
+así que la base queda como estaba. Los resultados se guardan en JSON para
+comparar versiones:
+
+    python scripts/benchmark_biblioteca.py -c odoo.conf -d biblioteca --libros 20000 --json bench.json
+    python scripts/benchmark_biblioteca.py -c odoo.conf -d biblioteca --comparar bench.json
+
+Debe ejecutarse con el mismo intérprete y addons_path que el servidor Odoo.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+
+import odoo
+from odoo import api, fields, SUPERUSER_ID
+from odoo.modules.registry import Registry
+
+from datos_prueba import cedula_valida, isbn13_valido
+
+# Campos de las vistas de lista, tal como los pide el cliente web
+LISTAS = {
+    'biblioteca.libro': ['titulo', 'autor', 'ejemplares', 'ejemplares_disponibles', 'isbn'],
+    'biblioteca.usuario': ['name', 'cedula', 'email', 'phone', 'prestamo_count', 'multa_pendiente_count',
+                           'bloqueado_prestamo'],
+    'biblioteca.prestamo': ['name', 'libro_id', 'usuario_id', 'fecha_prestamo', 'fecha_maxima', 'dias_retraso',
+                            'estado'],
+    'biblioteca.multa': ['name', 'usuario_id', 'prestamo_id', 'tipo_multa', 'dias_retraso', 'state'],
+}
+
+
+class Medidor:
+    """Mide tiempo y consultas SQL de cada paso, con la cache del ORM vacía al empezar."""
+
+    def __init__(self, env):
+        self.env = env
+        self.resultados = {}
+
+    def medir(self, nombre, funcion, cantidad=None):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        consultas = self.env.cr.sql_log_count
+        inicio = time.perf_counter()
+        funcion()
+        self.env.flush_all()
+        segundos = time.perf_counter() - inicio
+        resultado = {'segundos': round(segundos, 4), 'consultas': self.env.cr.sql_log_count - consultas}
+        if cantidad:
+            resultado['registros'] = cantidad
+            resultado['registros_segundo'] = round(cantidad / max(segundos, 1e-6), 1)
+        self.resultados[nombre] = resultado
+        print(f"{nombre:<32}{resultado['segundos']:>10.3f}s{resultado['consultas']:>9} consultas"
+              + (f"  ({resultado['registros_segundo']:.0f}/s)" if cantidad else ''))
+        return resultado
+
+
+def crear_por_lotes(modelo, valores, lote=2000):
+    registros = modelo.browse()
+    for i in range(0, len(valores), lote):
+        registros |= modelo.create(valores[i:i + lote])
+    return registros
+
+
+def generar(env, args, medidor, aleatorio):
+    """Datos base. Los lectores se reparten en grupos para que cada paso use lectores sin bloqueos."""
+    semilla = args.semilla * 10 ** 6
+    ahora = fields.Datetime.now()
+    dias_prestamo = env['biblioteca.configuracion'].get_parametros().dias_prestamo
+    datos = {}
+
+    medidor.medir('generar_autores', lambda: datos.update(autores=crear_por_lotes(env['biblioteca.autor'], [
+        {'firstname': f'Autor{i}', 'lastname': f'Bench{semilla + i}'} for i in range(args.autores)
+    ])), args.autores)
+    medidor.medir('generar_libros', lambda: datos.update(libros=crear_por_lotes(env['biblioteca.libro'], [
+        {'titulo': f'Libro de prueba {semilla + i}', 'isbn': isbn13_valido(semilla + i),
+         'autor': aleatorio.choice(datos['autores'].ids), 'ejemplares': args.ejemplares,
+         'genero': aleatorio.choice(['Novela', 'Ensayo', 'Poesía', 'Historia'])}
+        for i in range(args.libros)
+    ])), args.libros)
+    cedulas = [cedula_valida(semilla + i) for i in range(args.usuarios)]
+    # El generador y el módulo deben coincidir en el dígito verificador
+    invalidas = [cedula for cedula in cedulas if not env['biblioteca.usuario']._validar_cedula_ec(cedula)]
+    if invalidas:
+        raise RuntimeError(f"Cédulas generadas que el módulo rechaza: {invalidas[:5]}")
+    medidor.medir('generar_usuarios', lambda: datos.update(usuarios=crear_por_lotes(env['biblioteca.usuario'], [
+        {'name': f'Lector {semilla + i}', 'cedula': cedula, 'email': f'lector{semilla + i}@ejemplo.com'}
+        for i, cedula in enumerate(cedulas)
+    ])), args.usuarios)
+
+    cuarto = len(datos['usuarios']) // 4
+    datos['multados'], datos['vencidos'], datos['nuevos'] = (
+        datos['usuarios'][:cuarto], datos['usuarios'][cuarto:2 * cuarto], datos['usuarios'][2 * cuarto:])
+
+    # Historial ya devuelto: no cuenta para el stock ni para los crons
+    def historial():
+        valores = []
+        for _i in range(args.prestamos):
+            fecha = ahora - timedelta(days=aleatorio.randint(dias_prestamo + 1, 1500))
+            valores.append({
+                'libro_id': aleatorio.choice(datos['libros'].ids),
+                'usuario_id': aleatorio.choice(datos['usuarios'].ids),
+                'fecha_prestamo': fecha,
+                'fecha_devolucion': fecha + timedelta(days=aleatorio.randint(1, dias_prestamo)),
+                'estado': 'd',
+            })
+        datos['historial'] = crear_por_lotes(env['biblioteca.prestamo'], valores)
+    medidor.medir('generar_historial_prestamos', historial, args.prestamos)
+
+    def multas():
+        prestamos = datos['historial'][:args.multas]
+        datos['multas'] = crear_por_lotes(env['biblioteca.multa'], [{
+            'usuario_id': aleatorio.choice(datos['multados'].ids),
+            'prestamo_id': prestamo.id,
+            'tipo_multa': 'retraso',
+            'monto': 5.0,
+            'dias_retraso': 5,
+            'fecha_vencimiento': fields.Date.today() + timedelta(days=30),
+        } for prestamo in prestamos])
+    medidor.medir('generar_multas', multas, args.multas)
+
+    # Préstamos abiertos y ya vencidos, para el cron
+    def vencidos():
+        valores = []
+        for i in range(args.vencidos):
+            fecha = ahora - timedelta(days=dias_prestamo + aleatorio.randint(3, 60))
+            valores.append({
+                'libro_id': datos['libros'][i % len(datos['libros'])].id,
+                'usuario_id': aleatorio.choice(datos['vencidos'].ids),
+                'fecha_prestamo': fecha,
+                'estado': 'p',
+            })
+        datos['abiertos_vencidos'] = crear_por_lotes(env['biblioteca.prestamo'], valores)
+    medidor.medir('generar_prestamos_vencidos', vencidos, args.vencidos)
+    return datos
+
+
+def caminos_criticos(env, args, medidor, datos, aleatorio):
+    Prestamo = env['biblioteca.prestamo']
+
+    medidor.medir('cron_vencidos', lambda: Prestamo._cron_verificar_prestamos_vencidos(), args.vencidos)
+    # Segunda pasada: con la marca ya puesta no queda nada nuevo, debería costar casi nada
+    medidor.medir('cron_vencidos_incremental', lambda: Prestamo._cron_verificar_prestamos_vencidos())
+    medidor.medir('cron_montos_retraso', lambda: Prestamo._cron_actualizar_montos_retraso())
+
+    nuevos = {}
+    medidor.medir('crear_prestamos_masivo', lambda: nuevos.update(prestamos=Prestamo.create([{
+        'libro_id': aleatorio.choice(datos['libros'].ids),
+        'usuario_id': aleatorio.choice(datos['nuevos'].ids),
+        'estado': 'p',
+    } for _i in range(args.lote)])), args.lote)
+
+    a_devolver = nuevos['prestamos'][:args.devoluciones]
+    medidor.medir('devolver_a_tiempo', lambda: Prestamo.browse(a_devolver.ids).action_devolver(), len(a_devolver))
+    vencidos = datos['abiertos_vencidos'][:args.devoluciones]
+    medidor.medir('devolver_con_retraso', lambda: Prestamo.browse(vencidos.ids).action_devolver(), len(vencidos))
+
+    pendientes = env['biblioteca.multa'].search([('state', '=', 'pendiente'),
+                                                  ('usuario_id', 'in', datos['usuarios'].ids)])
+    medidor.medir('pagar_multas', lambda: env['biblioteca.multa'].browse(pendientes.ids).action_pagar(),
+                  len(pendientes))
+
+    for modelo, campos in LISTAS.items():
+        especificacion = {
+            campo: {'fields': {'display_name': {}}} if env[modelo]._fields[campo].type == 'many2one' else {}
+            for campo in campos
+        }
+        medidor.medir(f'lista_{modelo.split(".")[1]}',
+                      lambda: env[modelo].web_search_read([], especificacion, limit=80, count_limit=10001))
+    medidor.medir('lista_prestamos_con_retraso', lambda: Prestamo.web_search_read(
+        [('dias_retraso', '>', 0)], {'name': {}, 'dias_retraso': {}}, limit=80, order='dias_retraso desc'))
+
+    medidor.medir('archivar_prestamos', lambda: env['biblioteca.prestamo.archivo'].archivar_prestamos())
+    lector = datos['usuarios'][0]
+    medidor.medir('historial_lector', lambda: env['biblioteca.prestamo.historial'].web_search_read(
+        [('usuario_id', '=', lector.id)], {'name': {}, 'fecha_prestamo': {}, 'estado': {}}, limit=80))
+
+
+def comparar(actual, anterior):
+    print(f"\n{'paso':<32}{'antes (s)':>11}{'ahora (s)':>11}{'consultas':>16}")
+    for nombre, resultado in actual.items():
+        previo = anterior.get(nombre)
+        if not previo:
+            continue
+        marca = '  <-- más lento' if resultado['segundos'] > previo['segundos'] * 1.2 + 0.01 else ''
+        print(f"{nombre:<32}{previo['segundos']:>11.3f}{resultado['segundos']:>11.3f}"
+              f"{previo['consultas']:>8} -> {resultado['consultas']:<6}{marca}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help='Archivo de configuración de Odoo')
+    parser.add_argument('-d', '--db', required=True)
+    parser.add_argument('--autores', type=int, default=500)
+    parser.add_argument('--libros', type=int, default=5000)
+    parser.add_argument('--ejemplares', type=int, default=50)
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--prestamos', type=int, default=20000, help='Historial de préstamos ya devueltos')
+    parser.add_argument('--multas', type=int, default=2000)
+    parser.add_argument('--vencidos', type=int, default=1000, help='Préstamos abiertos ya vencidos')
+    parser.add_argument('--lote', type=int, default=500, help='Préstamos del create masivo')
+    parser.add_argument('--devoluciones', type=int, default=200)
+    parser.add_argument('--semilla', type=int, default=int(time.time()) % 1000)
+    parser.add_argument('--json', help='Archivo donde guardar los resultados')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para comparar')
+    parser.add_argument('--conservar', action='store_true', help='Confirmar los datos generados en la base')
+    args = parser.parse_args()
+
+    odoo.tools.config.parse_config(['-c', args.config] if args.config else [])
+    # Igual que en los tests: los crons e importadores no hacen commit intermedio
+    threading.current_thread().testing = True
+    aleatorio = random.Random(args.semilla)
+
+    registry = Registry(args.db)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        medidor = Medidor(env)
+        version_modulo = env['ir.module.module'].search([('name', '=', 'biblioteca')]).latest_version
+        try:
+            datos = generar(env, args, medidor, aleatorio)
+            caminos_criticos(env, args, medidor, datos, aleatorio)
+        finally:
+            if not args.conservar:
+                cr.rollback()
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump({
+                'fecha': fields.Datetime.to_string(fields.Datetime.now()),
+                'base': args.db,
+                'version_odoo': odoo.release.version,
+                'version_modulo': version_modulo,
+                'volumenes': {k: v for k, v in vars(args).items()
+                              if k not in ('config', 'db', 'json', 'comparar', 'conservar')},
+                'resultados': medidor.resultados,
+            }, archivo, indent=2)
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            comparar(medidor.resultados, json.load(archivo)['resultados'])
+
+
+if __name__ == '__main__':
+    main()
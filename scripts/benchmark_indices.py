@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los índices de circulación del módulo biblioteca.
+
+Crea en una base PostgreSQL de pruebas tablas con las columnas relevantes de
+biblioteca_prestamo y biblioteca_multa, las llena con datos sintéticos y
+ejecuta las consultas críticas con EXPLAIN ANALYZE antes y después de crear
+los mismos índices que declaran los métodos ``init()`` del módulo.
+
+Uso:
+    python scripts/benchmark_indices.py --dsn "dbname=bench" --prestamos 5000000 [--json resultado.json]
+
+Las tablas se crean en el esquema ``biblioteca_bench`` y se eliminan al final
+salvo que se pase ``--conservar``.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import time
+
+import psycopg2
+
+# Las definiciones de índices se leen del módulo sin importar Odoo
+_ruta_indices = os.path.join(os.path.dirname(__file__), '..', 'biblioteca', 'models', 'indices.py')
+_spec = importlib.util.spec_from_file_location('biblioteca_indices', _ruta_indices)
+indices = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(indices)
+
+ESQUEMA = 'biblioteca_bench'
+
+TABLAS = f"""
+DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE;
+CREATE SCHEMA {ESQUEMA};
+SET search_path TO {ESQUEMA};
+CREATE TABLE biblioteca_prestamo (
+    id serial PRIMARY KEY,
+    libro_id integer NOT NULL,
+    usuario_id integer NOT NULL,
+    estado varchar NOT NULL,
+    fecha_maxima timestamp,
+    fecha_devolucion timestamp,
+    notificacion_enviada boolean,
+    fecha_proximo_devengo timestamp,
+    multa double precision
+);
+CREATE TABLE biblioteca_multa (
+    id serial PRIMARY KEY,
+    prestamo_id integer NOT NULL,
+    usuario_id integer NOT NULL,
+    tipo_multa varchar NOT NULL,
+    state varchar NOT NULL,
+    monto double precision,
+    dias_retraso integer
+);
+"""
+
+# Distribución realista: la gran mayoría del historial ya está devuelto
+DATOS = """
+INSERT INTO biblioteca_prestamo (libro_id, usuario_id, estado, fecha_maxima, fecha_devolucion,
+                                 notificacion_enviada, multa)
+SELECT 1 + (random() * %(libros)s)::int,
+       1 + (random() * %(usuarios)s)::int,
+       estado,
+       fecha_maxima,
+       CASE WHEN estado = 'd' THEN fecha_maxima - interval '1 day' * (random() * 5) END,
+       estado = 'm',
+       0
+  FROM (SELECT CASE WHEN r < 0.93 THEN 'd' WHEN r < 0.98 THEN 'p' ELSE 'm' END AS estado,
+               now() - interval '1 day' * (random() * 1500) + interval '30 days' AS fecha_maxima
+          FROM (SELECT random() AS r FROM generate_series(1, %(prestamos)s)) g) s;
+INSERT INTO biblioteca_multa (prestamo_id, usuario_id, tipo_multa, state, monto, dias_retraso)
+SELECT id, usuario_id,
+       CASE WHEN random() < 0.9 THEN 'retraso' WHEN random() < 0.5 THEN 'danado' ELSE 'perdido' END,
+       CASE WHEN estado = 'm' AND random() < 0.7 THEN 'pendiente' ELSE 'pagada' END,
+       10, 10
+  FROM biblioteca_prestamo
+ WHERE estado = 'm' OR random() < 0.05;
+ANALYZE biblioteca_prestamo;
+ANALYZE biblioteca_multa;
+"""
+
+
+def sql_indices():
+    """Los mismos índices que crean BibliotecaPrestamo.init() y BibliotecaMulta.init()."""
+    sentencias = []
+    for tabla, definiciones in (('biblioteca_prestamo', indices.INDICES_PRESTAMO),
+                                ('biblioteca_multa', indices.INDICES_MULTA)):
+        for nombre, columnas, condicion in definiciones:
+            sentencias.append(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})"
+                              + (f" WHERE {condicion}" if condicion else ''))
+    # Índice del ORM por el index=True de usuario_id
+    sentencias.append("CREATE INDEX biblioteca_prestamo__usuario_id_index ON biblioteca_prestamo (usuario_id)")
+    sentencias += ["ANALYZE biblioteca_prestamo", "ANALYZE biblioteca_multa"]
+    return ';\n'.join(sentencias) + ';'
+
+CONSULTAS = {
+    'cron_vencidos': """
+        SELECT id FROM biblioteca_prestamo
+         WHERE estado = 'p' AND fecha_maxima < now() AND notificacion_enviada IS NOT TRUE
+         ORDER BY id LIMIT 500""",
+    'acumulacion_multas': """
+        SELECT id FROM biblioteca_prestamo
+         WHERE estado IN ('p', 'm') AND fecha_devolucion IS NULL AND fecha_maxima < now()""",
+    'disponibilidad_libro': """
+        SELECT libro_id, count(*) FROM biblioteca_prestamo
+         WHERE libro_id IN (1, 2, 3, 4, 5) AND estado IN ('p', 'm')
+         GROUP BY libro_id""",
+    'multa_retraso_pendiente': """
+        SELECT id FROM biblioteca_multa
+         WHERE prestamo_id IN (SELECT id FROM biblioteca_prestamo WHERE estado = 'm' LIMIT 500)
+           AND tipo_multa = 'retraso' AND state = 'pendiente'""",
+    'multas_pendientes_lector': """
+        SELECT usuario_id, count(*) FROM biblioteca_multa
+         WHERE state = 'pendiente' AND usuario_id IN (1, 2, 3, 4, 5)
+         GROUP BY usuario_id""",
+}
+
+
+def medir(cr, repeticiones):
+    resultados = {}
+    for nombre, consulta in CONSULTAS.items():
+        cr.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {consulta}")
+        plan = cr.fetchone()[0][0]
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            cr.execute(consulta)
+            cr.fetchall()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        resultados[nombre] = {
+            'mediana_ms': round(tiempos[len(tiempos) // 2], 3),
+            'plan_ms': plan['Execution Time'],
+            'nodo': plan['Plan']['Node Type'],
+            'plan': plan['Plan'],
+        }
+    return resultados
+
+
+def describir_nodos(plan):
+    nodos = [f"{plan['Node Type']}{' on ' + plan['Index Name'] if 'Index Name' in plan else ''}"]
+    for hijo in plan.get('Plans', []):
+        nodos.extend(describir_nodos(hijo))
+    return nodos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True, help='Cadena de conexión de psycopg2')
+    parser.add_argument('--prestamos', type=int, default=2_000_000)
+    parser.add_argument('--libros', type=int, default=50_000)
+    parser.add_argument('--usuarios', type=int, default=100_000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--json', help='Archivo donde guardar los resultados')
+    parser.add_argument('--conservar', action='store_true', help='No eliminar las tablas al terminar')
+    args = parser.parse_args()
+
+    conexion = psycopg2.connect(args.dsn)
+    conexion.autocommit = True
+    cr = conexion.cursor()
+    try:
+        inicio = time.perf_counter()
+        cr.execute(TABLAS)
+        cr.execute(DATOS, {'prestamos': args.prestamos, 'libros': args.libros, 'usuarios': args.usuarios})
+        print(f"Datos generados: {args.prestamos} préstamos en {time.perf_counter() - inicio:.1f}s")
+
+        antes = medir(cr, args.repeticiones)
+        inicio = time.perf_counter()
+        cr.execute(sql_indices())
+        print(f"Índices creados en {time.perf_counter() - inicio:.1f}s")
+        despues = medir(cr, args.repeticiones)
+
+        print(f"\n{'consulta':<28}{'antes (ms)':>12}{'después (ms)':>14}{'mejora':>9}")
+        for nombre in CONSULTAS:
+            a, d = antes[nombre]['mediana_ms'], despues[nombre]['mediana_ms']
+            print(f"{nombre:<28}{a:>12.2f}{d:>14.2f}{a / max(d, 1e-3):>8.1f}x")
+            print(f"    antes:   {' > '.join(describir_nodos(antes[nombre]['plan']))}")
+            print(f"    después: {' > '.join(describir_nodos(despues[nombre]['plan']))}")
+
+        if args.json:
+            with open(args.json, 'w') as archivo:
+                json.dump({'prestamos': args.prestamos, 'antes': antes, 'despues': despues}, archivo, indent=2)
+    finally:
+        if not args.conservar:
+            cr.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        conexion.close()
+
+
+if __name__ == '__main__':
+    main()
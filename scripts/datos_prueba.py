@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Generadores de datos sintéticos compartidos por los scripts de benchmark y de carga.
+
+Se importan desde los scripts de esta carpeta (``from datos_prueba import ...``),
+que se ejecutan como ``python scripts/<script>.py``.
+"""
+
+
+def cedula_valida(numero):
+    """
+    Cédula ecuatoriana de Pichincha (17) con dígito verificador; el módulo la
+    revisa con ``biblioteca.usuario._validar_cedula_ec`` al crear el lector.
+    """
+    base = f"17{numero % 10 ** 7:07d}"
+    total = 0
+    for i, digito in enumerate(base):
+        valor = int(digito) * (2 if i % 2 == 0 else 1)
+        total += valor - 9 if valor >= 10 else valor
+    return base + str((10 - total % 10) % 10)
+
+
+def isbn13_valido(numero):
+    """ISBN-13 con prefijo 978 y dígito de control correcto."""
+    base = f"978{numero % 10 ** 9:09d}"
+    control = (10 - sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(base)) % 10) % 10
+    return base + str(control)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga del endpoint JSON de circulación (/biblioteca/circulacion).
+
+Prepara lectores con cédulas válidas y libros con ISBN y muchos ejemplares,
+y luego lanza ciclos de préstamo y devolución desde varios hilos, midiendo
+la latencia de cada petición. Al final imprime p50, p95, p99 y el rendimiento.
+
+Uso:
+    python scripts/loadtest_circulacion.py --db biblioteca --hilos 8 --ciclos 200 [--isbns-por-peticion 3]
+"""
+
+import argparse
+import http.cookiejar
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+from datos_prueba import cedula_valida, isbn13_valido
+
+
+class ClienteJSON:
+    """Sesión HTTP autenticada en Odoo; cada hilo usa la suya."""
+
+    def __init__(self, url, db, user, password):
+        self.url = url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.llamar('/web/session/authenticate', {'db': db, 'login': user, 'password': password})
+
+    def llamar(self, ruta, params):
+        cuerpo = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params}).encode()
+        peticion = urllib.request.Request(f"{self.url}{ruta}", data=cuerpo,
+                                          headers={'Content-Type': 'application/json'})
+        with self.opener.open(peticion) as respuesta:
+            datos = json.load(respuesta)
+        if 'error' in datos:
+            raise RuntimeError(datos['error'].get('data', {}).get('message') or datos['error'])
+        return datos['result']
+
+
+def preparar(args):
+    common = xmlrpc.client.ServerProxy(f"{args.url}/xmlrpc/2/common")
+    uid = common.authenticate(args.db, args.user, args.password, {})
+    if not uid:
+        sys.exit("No se pudo autenticar contra Odoo.")
+    models = xmlrpc.client.ServerProxy(f"{args.url}/xmlrpc/2/object", allow_none=True)
+    semilla = int(time.time())
+    cedulas = [cedula_valida(semilla + i) for i in range(args.lectores)]
+    isbns = [isbn13_valido(semilla * 1000 + i) for i in range(args.libros)]
+    existentes = set(c['cedula'] for c in models.execute_kw(
+        args.db, uid, args.password, 'biblioteca.usuario', 'search_read',
+        [[('cedula', 'in', cedulas)]], {'fields': ['cedula']}))
+    models.execute_kw(args.db, uid, args.password, 'biblioteca.usuario', 'create', [[
+        {'name': f'Lector carga {c}', 'cedula': c} for c in cedulas if c not in existentes]])
+    models.execute_kw(args.db, uid, args.password, 'biblioteca.libro', 'create', [[
+        {'titulo': f'Libro carga {isbn}', 'isbn': isbn, 'ejemplares': args.hilos * args.isbns_por_peticion}
+        for isbn in isbns]])
+    return cedulas, isbns
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8069')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--ciclos', type=int, default=100, help='Ciclos préstamo+devolución por hilo')
+    parser.add_argument('--lectores', type=int, default=50)
+    parser.add_argument('--libros', type=int, default=200)
+    parser.add_argument('--isbns-por-peticion', type=int, default=2)
+    args = parser.parse_args()
+
+    cedulas, isbns = preparar(args)
+    latencias = {'prestar': [], 'devolver': []}
+    errores = []
+    lock = threading.Lock()
+
+    def trabajador(indice):
+        cliente = ClienteJSON(args.url, args.db, args.user, args.password)
+        aleatorio = random.Random(indice)
+        for _ in range(args.ciclos):
+            cedula = aleatorio.choice(cedulas)
+            lote = aleatorio.sample(isbns, args.isbns_por_peticion)
+            for operacion in ('prestar', 'devolver'):
+                inicio = time.perf_counter()
+                try:
+                    resultado = cliente.llamar('/biblioteca/circulacion',
+                                               {'cedula': cedula, 'isbns': lote, 'operacion': operacion})
+                    fallidos = [r for r in resultado['resultados'] if not r['ok']]
+                except Exception as e:
+                    fallidos = [str(e)]
+                duracion = (time.perf_counter() - inicio) * 1000
+                with lock:
+                    latencias[operacion].append(duracion)
+                    errores.extend(fallidos)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as pool:
+        list(pool.map(trabajador, range(args.hilos)))
+    total = time.perf_counter() - inicio
+
+    peticiones = sum(len(v) for v in latencias.values())
+    print(f"{peticiones} peticiones en {total:.1f}s ({peticiones / total:.1f} req/s), {len(errores)} errores")
+    for operacion, valores in latencias.items():
+        valores.sort()
+        print(f"{operacion:<10} p50 {percentil(valores, 50):7.1f} ms   p95 {percentil(valores, 95):7.1f} ms   "
+              f"p99 {percentil(valores, 99):7.1f} ms   media {statistics.mean(valores):7.1f} ms")
+    if errores:
+        print(f"Primeros errores: {errores[:5]}")
+
+
+if __name__ == '__main__':
+    main()
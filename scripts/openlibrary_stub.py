@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor HTTP local que imita las rutas de OpenLibrary usadas por el módulo
+biblioteca (search, works y editions) con respuestas deterministas.
+
+Uso:
+    python scripts/openlibrary_stub.py --puerto 8765 [--latencia 0.2] [--fallos 0.1]
+
+Después se apunta Odoo al servidor con el parámetro del sistema
+``biblioteca.openlibrary_url = http://localhost:8765``. Al terminar (Ctrl+C)
+se imprime cuántas peticiones llegaron por ruta, lo que permite comprobar
+que las búsquedas repetidas se sirven desde la cache.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+peticiones = Counter()
+
+
+def _work_key(texto):
+    return f"/works/OL{int(hashlib.md5(texto.encode()).hexdigest()[:6], 16)}W"
+
+
+def _isbn10(work_key):
+    numero = int(re.sub(r'\D', '', work_key)) % 10 ** 9
+    base = f"{numero:09d}"
+    total = sum((10 - i) * int(d) for i, d in enumerate(base))
+    control = (11 - total % 11) % 11
+    return base + ('X' if control == 10 else str(control))
+
+
+def respuesta_para(ruta, params):
+    if ruta == '/search.json':
+        texto = params.get('q', [''])[0]
+        if not texto or texto.startswith('inexistente'):
+            return {'numFound': 0, 'docs': []}
+        return {'numFound': 1, 'docs': [{
+            'key': _work_key(texto),
+            'title': texto.title(),
+            'author_name': [f"Autor {texto.split()[0].title()}"],
+            'first_publish_year': 1950 + len(texto) % 70,
+            'publisher': ['Editorial Stub'],
+        }]}
+    match = re.fullmatch(r'(/works/OL\d+W)(/editions)?\.json', ruta)
+    if not match:
+        return None
+    work_key, ediciones = match.groups()
+    if ediciones:
+        return {'entries': [{
+            'number_of_pages': 100 + len(work_key) * 7,
+            'isbn_10': [_isbn10(work_key)],
+            'publishers': ['Editorial Stub'],
+        }]}
+    return {'key': work_key, 'description': {'value': f"Descripción de {work_key}"},
+            'subjects': ['Ficción', 'Novela', 'Clásicos', 'Otros']}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latencia = 0.0
+    fallos = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/editions.json'):
+            peticiones['editions'] += 1
+        elif url.path.startswith('/works/'):
+            peticiones['works'] += 1
+        else:
+            peticiones[url.path] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.fallos and random.random() < self.fallos:
+            self.send_error(503, 'Fallo simulado')
+            return
+        datos = respuesta_para(url.path, parse_qs(url.query))
+        if datos is None:
+            self.send_error(404)
+            return
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.0, help='Segundos de espera por petición')
+    parser.add_argument('--fallos', type=float, default=0.0, help='Proporción de respuestas 503')
+    args = parser.parse_args()
+
+    StubHandler.latencia = args.latencia
+    StubHandler.fallos = args.fallos
+    servidor = ThreadingHTTPServer((args.host, args.puerto), StubHandler)
+    print(f"Stub de OpenLibrary en http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        print(f"Peticiones recibidas: {dict(peticiones)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor SMTP de depuración: acepta todos los correos, no los reenvía y
+los guarda en un archivo mbox para revisarlos.
+
+Uso:
+    python scripts/smtp_sink.py --puerto 1025 --mbox /tmp/biblioteca.mbox
+
+En Odoo se configura un servidor de correo saliente en localhost:1025 sin
+cifrado. Después de ejecutar el cron de préstamos vencidos, los correos
+quedan en la cola y se entregan al ejecutar "Correo: administrador de cola
+de correo electrónico"; el sink muestra cuántos llegaron y a quién.
+"""
+
+import argparse
+import mailbox
+import socketserver
+import threading
+from email import message_from_bytes
+from email.policy import default
+
+recibidos = 0
+lock = threading.Lock()
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    mbox = None
+
+    def responder(self, linea):
+        self.wfile.write(f"{linea}\r\n".encode())
+
+    def handle(self):
+        self.responder('220 biblioteca smtp sink')
+        destinatarios = []
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode(errors='replace').strip()
+            verbo = comando[:4].upper()
+            if verbo in ('HELO', 'EHLO'):
+                self.responder('250 sink')
+            elif verbo == 'MAIL':
+                destinatarios = []
+                self.responder('250 OK')
+            elif verbo == 'RCPT':
+                destinatarios.append(comando.split(':', 1)[-1].strip(' <>'))
+                self.responder('250 OK')
+            elif verbo == 'DATA':
+                self.responder('354 Fin con <CRLF>.<CRLF>')
+                self.guardar(self.leer_datos(), destinatarios)
+                self.responder('250 OK')
+            elif verbo == 'QUIT':
+                self.responder('221 Adiós')
+                return
+            else:
+                # RSET, NOOP y demás: se aceptan sin hacer nada
+                self.responder('250 OK')
+
+    def leer_datos(self):
+        lineas = []
+        while True:
+            linea = self.rfile.readline()
+            if linea in (b'.\r\n', b'.\n', b''):
+                return b''.join(lineas)
+            lineas.append(linea[1:] if linea.startswith(b'..') else linea)
+
+    def guardar(self, datos, destinatarios):
+        global recibidos
+        mensaje = message_from_bytes(datos, policy=default)
+        with lock:
+            recibidos += 1
+            if self.mbox is not None:
+                self.mbox.add(mensaje)
+                self.mbox.flush()
+            print(f"[{recibidos}] {', '.join(destinatarios)}: {mensaje['Subject']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=1025)
+    parser.add_argument('--mbox', help='Archivo mbox donde guardar los correos')
+    args = parser.parse_args()
+
+    if args.mbox:
+        SMTPSinkHandler.mbox = mailbox.mbox(args.mbox)
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    servidor = socketserver.ThreadingTCPServer((args.host, args.puerto), SMTPSinkHandler)
+    print(f"SMTP sink en {args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        print(f"Correos recibidos: {recibidos}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de estrés de préstamos concurrentes contra un Odoo local.
+
+Crea un libro con pocos ejemplares y lanza muchos préstamos en paralelo
+mediante ``biblioteca.prestamo.prestar_libro``. Al final verifica que nunca
+haya más préstamos activos que ejemplares.
+
+Uso:
+    python scripts/stress_prestamos.py --db biblioteca --ejemplares 3 --intentos 50
+
+Odoo debe ejecutarse con varios workers (``--workers``) para que los préstamos
+lleguen realmente en paralelo a PostgreSQL.
+"""
+
+import argparse
+import sys
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+
+def conectar(args):
+    common = xmlrpc.client.ServerProxy(f"{args.url}/xmlrpc/2/common")
+    uid = common.authenticate(args.db, args.user, args.password, {})
+    if not uid:
+        sys.exit("No se pudo autenticar contra Odoo.")
+    return uid
+
+
+def ejecutar(args, uid, model, method, *params, **kw):
+    # Cada hilo usa su propio proxy: ServerProxy no es seguro entre hilos
+    models = xmlrpc.client.ServerProxy(f"{args.url}/xmlrpc/2/object", allow_none=True)
+    return models.execute_kw(args.db, uid, args.password, model, method, list(params), kw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8069')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--ejemplares', type=int, default=3)
+    parser.add_argument('--intentos', type=int, default=50)
+    parser.add_argument('--hilos', type=int, default=16)
+    args = parser.parse_args()
+
+    uid = conectar(args)
+    libro_id = ejecutar(args, uid, 'biblioteca.libro', 'create', [{
+        'titulo': f'Stress {int(time.time())}',
+        'ejemplares': args.ejemplares,
+    }])[0]
+    usuario_ids = ejecutar(args, uid, 'biblioteca.usuario', 'create', [
+        {'name': f'Lector stress {i}'} for i in range(args.intentos)
+    ])
+
+    def prestar(usuario_id):
+        try:
+            ejecutar(args, uid, 'biblioteca.prestamo', 'prestar_libro', libro_id, usuario_id)
+            return True
+        except xmlrpc.client.Fault:
+            return False
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as pool:
+        resultados = list(pool.map(prestar, usuario_ids))
+    duracion = time.perf_counter() - inicio
+
+    activos = ejecutar(args, uid, 'biblioteca.prestamo', 'search_count', [
+        ('libro_id', '=', libro_id), ('estado', 'in', ['p', 'm']),
+    ])
+    disponibles = ejecutar(args, uid, 'biblioteca.libro', 'read', [libro_id], ['ejemplares_disponibles'])[0]
+
+    print(f"Intentos: {args.intentos} en {duracion:.2f}s ({args.intentos / duracion:.1f}/s)")
+    print(f"Préstamos aceptados: {sum(resultados)}, rechazados: {resultados.count(False)}")
+    print(f"Préstamos activos: {activos} de {args.ejemplares} ejemplares, "
+          f"disponibles según el contador: {disponibles['ejemplares_disponibles']}")
+
+    if activos > args.ejemplares or activos != sum(resultados):
+        sys.exit("ERROR: se prestaron más ejemplares de los existentes.")
+    if disponibles['ejemplares_disponibles'] != args.ejemplares - activos:
+        sys.exit("ERROR: el contador de ejemplares disponibles no coincide.")
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()